@@ -1,4 +1,14 @@
 #!/bin/sh
 stagekit run tests.test_mpi:test
 stagekit run tests.test:inversion
-python tests/sp.py
\ No newline at end of file
+stagekit run tests.test:inversion -k 2
+stagekit run tests.test:inversion
+python tests/sp.py
+stagekit run tests.test_gc:test
+stagekit run tests.test_gc:check
+stagekit run tests.test_directory:test
+stagekit run tests.test_mpiexec:test
+stagekit run tests.test_journal:test -r -k
+stagekit run tests.test_journal:test
+stagekit run tests.test_sqlite:test -r -k
+stagekit run tests.test_sqlite:test
@@ -1,9 +1,14 @@
 from __future__ import annotations
-from typing import List, TYPE_CHECKING
+from typing import List, Dict, Tuple, TYPE_CHECKING
 from importlib import import_module
+from os import fsync
+from sys import stderr
+import pickle
 
 from .directory import ws
 from .config import config
+from .writer import writer
+from . import checksum
 
 
 if TYPE_CHECKING:
@@ -13,19 +18,179 @@ if TYPE_CHECKING:
 # cache of stagekit.pickle
 _cache: List[Stage] | None = None
 
+# number of records appended since the last snapshot was taken by save_cache()
+_journal_size = 0
+
+# stagekit.journal may exist on disk (set when a record is written, cleared only by _save() in the writer thread)
+_journal_exists = False
+
 
 def load_cache() -> List[Stage]:
-    global _cache
+    global _cache, _journal_exists
 
     if _cache is None:
         for src in config['modules']:
             if src not in config['exclude_modules']:
                 import_module(src)
 
-        if ws.has('stagekit.pickle'):
-            _cache = ws.load('stagekit.pickle')
-        
+        if config['state_backend'] == 'sqlite':
+            from .sqlite import load
+
+            _cache = load()
+
+        elif ws.has('stagekit.pickle'):
+            with open(ws.path('stagekit.pickle'), 'rb') as fb:
+                _cache = pickle.loads(checksum.load(fb))
+
         else:
             _cache = []
-    
+
+        if config['state_backend'] == 'pickle' and ws.has('stagekit.journal'):
+            _journal_exists = True
+            _replay(_cache) # type: ignore
+
     return _cache # type: ignore
+
+
+def append_journal(stage: Stage) -> int:
+    """Append the state of a stage (without child stages) to stagekit.journal.
+
+    Returns:
+        int: Number of records in stagekit.journal.
+    """
+    global _journal_size
+
+    # ids of parent stages from root stage
+    path = []
+    parent = stage.parent
+
+    while parent:
+        path.insert(0, parent.id)
+        parent = parent.parent
+
+    record = pickle.dumps((stage.id, path, stage._state()))
+    codec = checksum.compression('checkpoint')
+    writer.submit(lambda: _append(record, codec))
+    _journal_size += 1
+
+    return _journal_size
+
+
+def save_cache(stages: List[Stage]):
+    """Serialize stages and save to stagekit.pickle in the writer thread.
+        Completed stages keep their serialized records (Stage._record()), so only stages on the path
+        to changed stages are pickled here and the rest is joined from cached bytes."""
+    global _journal_size
+
+    # taken on the event loop so that the snapshot is consistent, compression and I/O are done in the writer thread
+    data = pickle.dumps(stages)
+    codec = checksum.compression('checkpoint')
+    _journal_size = 0
+
+    # records in stagekit.journal that are still pending are included in the snapshot
+    writer.submit(lambda: _save(data, codec), True)
+
+
+def _write(data: bytes, dst: str, mode: str, codec: Tuple[str | None, int | None]):
+    """Write bytes with checksum to a file in workspace (compressed with the return value of checksum.compression())."""
+    # saved state must not refer to data that failed to be written
+    writer.check()
+
+    if not ws.has():
+        ws.mkdir()
+
+    with open(ws.path(dst), mode) as fb:
+        checksum.dump(data, fb, None, *codec)
+        fb.flush()
+        fsync(fb.fileno())
+
+
+def _append(record: bytes, codec: Tuple[str | None, int | None]):
+    """Append a record to stagekit.journal."""
+    global _journal_exists
+
+    # set before writing, so that a partially written record is also removed by the next snapshot
+    _journal_exists = True
+    _write(record, 'stagekit.journal', 'ab', codec)
+
+
+def _save(data: bytes, codec: Tuple[str | None, int | None]):
+    """Write stagekit.pickle and remove stagekit.journal, whose records are all included in it.
+        Records submitted after the snapshot are written after this function returns, so they are kept."""
+    global _journal_exists
+
+    _write(data, '_stagekit.pickle', 'wb', codec)
+
+    with open(ws.path('_stagekit.pickle'), 'rb') as fb:
+        # verify saved state
+        if not checksum.verify(fb):
+            raise checksum.ChecksumError('failed to save stagekit.pickle')
+
+    ws.mv('_stagekit.pickle', 'stagekit.pickle')
+
+    # checked in the writer thread instead of when the snapshot is taken,
+    # because a pending snapshot that would have removed the journal may have been replaced by this one
+    if _journal_exists:
+        ws.rm('stagekit.journal')
+        _journal_exists = False
+
+
+def _replay(stages: List[Stage]):
+    """Apply records in stagekit.journal to stages loaded from stagekit.pickle."""
+    from .stage import Stage
+
+    global _journal_size
+
+    # saved stages indexed by Stage.id (child stages are indexed when a record refers to them)
+    ids: Dict[bytes, Stage] = {s.id: s for s in stages}
+
+    def find(sid: bytes, pid: bytes | None) -> Stage | None:
+        if sid not in ids and pid is not None:
+            for c in ids[pid].history:
+                ids[c.id] = c
+
+        return ids.get(sid)
+
+    with open(ws.path('stagekit.journal'), 'rb') as fb:
+        while True:
+            try:
+                sid, path, state = pickle.loads(checksum.load(fb))
+
+                if isinstance(sid, str):
+                    # saved by an older version as hex strings
+                    sid, path = bytes.fromhex(sid), [bytes.fromhex(pid) for pid in path]
+
+            except EOFError:
+                break
+
+            except Exception:
+                # last record is incomplete
+                print('warning: stagekit.journal is truncated', file=stderr)
+                break
+
+            # load parent stages on the path to the stage, records of stages that were removed with a parent are skipped
+            if not all(find(pid, path[i - 1] if i > 0 else None) for i, pid in enumerate(path)):
+                continue
+
+            pid = path[-1] if path else None
+
+            if s := find(sid, pid):
+                s._restore(state)
+                s.touch()
+
+            else:
+                s = ids[sid] = Stage.__new__(Stage)
+                s.__setstate__(state)
+
+                if pid is None:
+                    stages.insert(0, s)
+
+                else:
+                    s.parent = ids[pid]
+                    s.parent.append(s)
+
+            if s.done:
+                # outdated child stages are removed when a stage is completed
+                s.history = [c for c in s.history if c.parent_version == s.version]
+
+            _journal_size += 1
@@ -0,0 +1,286 @@
+from __future__ import annotations
+from typing import BinaryIO, Dict, List, Set, Tuple, Callable, Any
+from hashlib import blake2b
+from struct import Struct
+from mmap import mmap, ACCESS_COPY, ALLOCATIONGRANULARITY
+from os import fstat
+import zlib
+import lzma
+import bz2
+
+from .config import config
+
+
+# identifier of a section with checksum
+MAGIC = b'SKC1'
+
+# identifier of a compressed section with checksum
+MAGIC_CODEC = b'SKC2'
+
+# header of a section: magic, length of data, blake2b digest of data
+_header = Struct('<4sQ32s')
+
+# header of a compressed section: magic, codec name, compression level (255 for default or a level outside 0-254),
+# length of compressed data, blake2b digest of uncompressed data (the level is informational and not used to decompress)
+_header_codec = Struct('<4s8sBQ32s')
+
+# size of blocks for streaming hash
+_block = 16 * 1024 ** 2
+
+# dict of codec name -> (function to compress data with a level, function to create a streaming decompressor)
+_codecs: Dict[str, Tuple[Callable[[bytes, int | None], bytes], Callable[[], Any]]] = {}
+
+# codecs and compression levels checked by compression()
+_checked: Set[Tuple[str, int | None]] = set()
+
+
+class ChecksumError(IOError):
+    """Saved data is truncated or corrupted."""
+
+
+def define_codec(name: str, compress: Callable[[bytes, int | None], bytes], decompressor: Callable[[], Any]):
+    """Define a compression codec.
+
+    Args:
+        name (str): Name of the codec saved in section headers (at most 8 bytes).
+        compress (Callable[[bytes, int | None], bytes]): Function to compress data with a compression level (None for default).
+        decompressor (Callable[[], Any]): Function to create an object whose decompress() method decompresses data incrementally.
+    """
+    if len(name.encode()) > 8:
+        raise ValueError(f'codec name `{name}` is longer than 8 bytes')
+
+    _codecs[name] = compress, decompressor
+
+
+def compression(store: str) -> Tuple[str | None, int | None]:
+    """Get the codec and compression level of a store from config['compression'].
+
+    Args:
+        store (str): Name of the store ('checkpoint' or 'data').
+
+    Raises:
+        ValueError: Unknown codec or invalid compression level (checked before data is passed to the writer thread).
+    """
+    codec = config['compression'].get(store)
+
+    if not codec:
+        return None, None
+
+    name, level = (codec, None) if isinstance(codec, str) else (codec[0], codec[1])
+
+    if (name, level) not in _checked:
+        if name not in _codecs:
+            raise ValueError(f'unknown codec `{name}` in config[\'compression\'][\'{store}\']')
+
+        try:
+            _codecs[name][0](b'', level)
+
+        except Exception as e:
+            raise ValueError(f'invalid compression level {level!r} of codec `{name}`: {e}')
+
+        _checked.add((name, level))
+
+    return name, level
+
+
+def digest(data: bytes | memoryview | List[bytes | memoryview]) -> bytes:
+    """Checksum of data saved in the header (data can be given as parts to be written without joining)."""
+    h = blake2b(digest_size=32)
+
+    for part in data if isinstance(data, list) else (data,):
+        h.update(part)
+
+    return h.digest()
+
+
+def dump(data: bytes | List[bytes | memoryview], fb: BinaryIO, checksum: bytes | None = None,
+         codec: str | None = None, level: int | None = None, align: int = 1) -> int:
+    """Write data with a header containing its length and checksum.
+
+    Args:
+        data (bytes | List[bytes | memoryview]): Data to write, or its parts (e.g. return value of io.pickle.dumps()).
+        fb (BinaryIO): File to write to.
+        checksum (bytes | None, optional): Return value of digest(data) if already computed. Defaults to None.
+        codec (str | None, optional): Name of the codec to compress data with. Defaults to None.
+        level (int | None, optional): Compression level, None for the default level of the codec. Defaults to None.
+        align (int, optional): Pad before the header so that uncompressed data starts at a multiple of align in the file. Defaults to 1.
+
+    Returns:
+        int: Position of the header in the file.
+    """
+    parts = data if isinstance(data, list) else [data]
+
+    if codec is None:
+        fb.write(b'\0' * (-(fb.tell() + _header.size) % align))
+        position = fb.tell()
+        fb.write(_header.pack(MAGIC, sum(len(part) for part in parts), checksum or digest(parts)))
+
+        # parts are written separately, so that large buffers are not copied
+        for part in parts:
+            fb.write(part)
+
+    else:
+        data = b''.join(parts)
+        packed = _codecs[codec][0](data, level)
+        code = level if level is not None and 0 <= level < 255 else 255
+        position = fb.tell()
+        fb.write(_header_codec.pack(MAGIC_CODEC, codec.encode(), code, len(packed), checksum or digest(data)))
+        fb.write(packed)
+
+    return position
+
+
+def load(fb: BinaryIO) -> bytes:
+    """Read a section written by dump(), decompress it and validate its checksum.
+        Files without a header (saved by an older version) are returned as is.
+
+    Raises:
+        EOFError: No more sections to read.
+        ChecksumError: Section is truncated or corrupted.
+    """
+    head = fb.read(len(MAGIC))
+
+    if len(head) == 0:
+        raise EOFError()
+
+    if head not in (MAGIC, MAGIC_CODEC):
+        return head + fb.read()
+
+    codec, size, checksum = _read_header(head, fb)
+    data = fb.read(size)
+
+    if len(data) < size:
+        raise ChecksumError(f'expected {size} bytes, got {len(data)}')
+
+    if codec is not None:
+        try:
+            data = _decompressor(codec).decompress(data)
+
+        except ChecksumError:
+            raise
+
+        except Exception as e:
+            raise ChecksumError(f'failed to decompress: {e}')
+
+    if digest(data) != checksum:
+        raise ChecksumError('checksum mismatch')
+
+    return data
+
+
+def load_mapped(fb: BinaryIO) -> memoryview:
+    """Validate a section written by dump() and get its data as a copy-on-write memory map of the file instead of reading it,
+        so that buffers loaded from the data are writable and not copied. Compressed sections are decompressed into memory.
+
+    Raises:
+        EOFError: No more sections to read.
+        ChecksumError: Section is truncated or corrupted.
+    """
+    start = fb.tell()
+    head = fb.read(len(MAGIC))
+
+    if len(head) == 0:
+        raise EOFError()
+
+    codec, size, checksum = _read_header(head, fb)
+
+    if codec is not None or size == 0:
+        fb.seek(start)
+        return memoryview(bytearray(load(fb)))
+
+    offset = fb.tell()
+
+    if offset + size > fstat(fb.fileno()).st_size:
+        raise ChecksumError(f'expected {size} bytes, got {fstat(fb.fileno()).st_size - offset}')
+
+    # offset of a memory map must be a multiple of the allocation granularity
+    base = offset - offset % ALLOCATIONGRANULARITY
+    data = memoryview(mmap(fb.fileno(), offset + size - base, access=ACCESS_COPY, offset=base))[offset - base:]
+
+    if digest(data) != checksum:
+        raise ChecksumError('checksum mismatch')
+
+    return data
+
+
+def peek(fb: BinaryIO) -> bytes | None:
+    """Read the checksum in the header of the section at current position without reading its data."""
+    try:
+        return _read_header(fb.read(len(MAGIC)), fb)[2]
+
+    except ChecksumError:
+        return None
+
+
+def verify(fb: BinaryIO) -> bool:
+    """Check all sections of a file with streaming hash."""
+    while head := fb.read(len(MAGIC)):
+        try:
+            codec, size, checksum = _read_header(head, fb)
+            decompressor = None if codec is None else _decompressor(codec)
+
+        except ChecksumError:
+            return False
+
+        h = blake2b(digest_size=32)
+
+        while size > 0:
+            block = fb.read(min(size, _block))
+
+            if not block:
+                return False
+
+            size -= len(block)
+
+            if decompressor is None:
+                h.update(block)
+
+            else:
+                try:
+                    h.update(decompressor.decompress(block))
+
+                except Exception:
+                    return False
+
+        if h.digest() != checksum:
+            return False
+
+    return True
+
+
+def _read_header(head: bytes, fb: BinaryIO) -> Tuple[str | None, int, bytes]:
+    """Read the rest of a header after its magic, returns codec name, length of saved data and checksum."""
+    if head == MAGIC:
+        header = _header
+
+    elif head == MAGIC_CODEC:
+        header = _header_codec
+
+    else:
+        raise ChecksumError('invalid header')
+
+    head += fb.read(header.size - len(head))
+
+    if len(head) < header.size:
+        raise ChecksumError('incomplete header')
+
+    if header is _header:
+        _, size, checksum = header.unpack(head)
+
+        return None, size, checksum
+
+    _, codec, _, size, checksum = header.unpack(head)
+
+    return codec.rstrip(b'\0').decode(), size, checksum
+
+
+def _decompressor(codec: str) -> Any:
+    if codec not in _codecs:
+        raise ChecksumError(f'unknown codec `{codec}`')
+
+    return _codecs[codec][1]()
+
+
+define_codec('zlib', lambda data, level: zlib.compress(data, -1 if level is None else level), zlib.decompressobj)
+define_codec('lzma', lambda data, level: lzma.compress(data, preset=level), lzma.LZMADecompressor)
+define_codec('bz2', lambda data, level: bz2.compress(data, 9 if level is None else level), bz2.BZ2Decompressor)
@@ -0,0 +1,105 @@
+from __future__ import annotations
+from typing import List, Dict, Set, Any, TYPE_CHECKING
+from collections.abc import Mapping
+from glob import glob, escape
+from os import path, remove
+
+from .directory import ws
+from .data import data
+from .data.data import Data, compact_chunk
+
+if TYPE_CHECKING:
+    from .stage import Stage
+
+
+# file in workspace that records the stage running each mpiexec task (<fname> <stage id> per line)
+PATH_TASKS = 'stagekit.tasks'
+
+
+def gc(stages: List[Stage]) -> int:
+    """Remove saved data and mpiexec task files that are not used by any saved stage.
+        Should not be called while a workflow in the same workspace is running in another process.
+
+    Args:
+        stages (List[Stage]): Saved root stages (return value of load_cache()).
+
+    Returns:
+        int: Number of bytes reclaimed.
+    """
+    # ids of saved stages
+    ids: Set[bytes] = set()
+
+    # indices of items in use in each data chunk
+    chunks: Dict[int, Set[int]] = {}
+
+    # file names of memory-mapped arrays in use
+    arrays: Set[str] = set()
+
+    def collect(val: Any):
+        if isinstance(val, Data):
+            if isinstance(val.location, tuple):
+                chunks.setdefault(val.location[0], set()).add(val.location[1])
+
+            elif isinstance(val.location, str):
+                arrays.add(val.location)
+
+        elif isinstance(val, (list, tuple)):
+            for v in val:
+                collect(v)
+
+        # kwargs of stages executed in this process are MappingProxyType
+        elif isinstance(val, Mapping):
+            for v in val.values():
+                collect(v)
+
+    # child stages of outdated versions are included because they can still be reused before removed
+    queue = list(stages)
+
+    while queue:
+        stage = queue.pop()
+        ids.add(stage.id)
+        args, kwargs = stage.flatargs()
+        collect(args)
+        collect(kwargs)
+        queue.extend(stage.history)
+
+    reclaimed = 0
+
+    # data chunks
+    for idx in sorted({int(name[5:].split('.')[0]) for name in ws.ls(grep='data#*.*')
+                       if name.endswith(('.bin', '.pickle'))}):
+        reclaimed += compact_chunk(idx, chunks.get(idx, set()))
+
+    # locations of removed items are no longer valid for deduplication
+    data._data_digests = None
+
+    # memory-mapped arrays (and files of interrupted writes)
+    for name in ws.ls(grep='array#*'):
+        if name not in arrays:
+            reclaimed += _remove(ws.path(name))
+
+    # mpiexec task files of removed stages
+    if ws.has(PATH_TASKS):
+        lines = []
+
+        for line in ws.readlines(PATH_TASKS):
+            if line:
+                fname, sid = line.rsplit(' ', 1)
+
+                if bytes.fromhex(sid) in ids:
+                    lines.append(line)
+
+                else:
+                    for src in glob(escape(ws.path(fname)) + '.*'):
+                        reclaimed += _remove(src)
+
+        ws.writelines(lines + [''], PATH_TASKS)
+
+    return reclaimed
+
+
+def _remove(src: str) -> int:
+    size = path.getsize(src)
+    remove(src)
+
+    return size
@@ -101,9 +101,48 @@ def cli_log():
         Flags:
             -a: Expand all entries.
     """
-    from stagekit.cache import load_cache
+    from .config import config
+
+    if config['state_backend'] == 'sqlite':
+        from .sqlite import log
+
+        print(log())
+
+    else:
+        from .cache import load_cache
+
+        print(repr(load_cache()))
+
+
+def cli_gc():
+    """Remove saved data and mpiexec task files that are no longer used by the workflows in current directory.
+    """
+    from .cleanup import gc
+    from .cache import load_cache
 
-    print(repr(load_cache()))
+    print(f'reclaimed {gc(load_cache()) / 1024 ** 2:.2f}MB')
+
+
+def cli_history():
+    """Print the number of runs, median and 90th percentile of elapsed time and mean queue wait of mpiexec tasks.
+    """
+    from .history import records, estimate
+
+    sigs = {}
+
+    for rec in records():
+        sigs.setdefault(rec.signature, []).append(rec)
+
+    for sig, recs in sigs.items():
+        ok = sum(rec.success for rec in recs)
+        wait = sum(rec.wait for rec in recs) / len(recs)
+
+        if ok:
+            print(f'{sig}\n  runs: {len(recs)} ({len(recs) - ok} failed), '
+                  f'elapsed: {estimate(sig):.1f}s (median) {estimate(sig, 90):.1f}s (p90), wait: {wait:.1f}s')
+
+        else:
+            print(f'{sig}\n  runs: {len(recs)} ({len(recs)} failed), wait: {wait:.1f}s')
 
 
 def cli_log_str(stage, indent):
@@ -197,6 +236,8 @@ commands = {
     'run': cli_run,
     'help': cli_help,
     'log': cli_log,
+    'gc': cli_gc,
+    'history': cli_history,
     'config': cli_config,
     'write': cli_write,
     'work': cli_work
@@ -221,4 +262,3 @@ def cli():
                 return
     
     cli_help()
-ss
\ No newline at end of file
@@ -1,6 +1,6 @@
 import tomllib
 from os import environ
-from typing import List, Literal, TypedDict, NotRequired
+from typing import List, Dict, Literal, TypedDict, NotRequired
 from os.path import expanduser
 
 
@@ -18,9 +18,55 @@ class Config(TypedDict):
     # default re-run behavior 
     rerun_strategy: bool | Literal['auto']
 
-    # save cached data to a separate file when the buffer size is larger than a specific value (in MB)
+    # start a new data file when the current one is larger than a specific value (in MB)
     data_chunk_size: int | float | None
 
+    # save numpy arrays larger than a specific value (in MB) as .npy files that are memory-mapped when loaded
+    # None or false: save all arrays in data chunks
+    data_mmap_size: int | float | None
+
+    # access mode of memory-mapped arrays ('r': read-only, 'c': copy-on-write, changes are not saved)
+    data_mmap_mode: Literal['r', 'c']
+
+    # compare the content of numpy arrays after their digests match (saved arrays are loaded for comparison)
+    data_verify: bool
+
+    # memory budget (in MB) of data loaded from data files, least recently used data is released when exceeded
+    # None or false: keep all loaded data
+    data_cache_mb: int | float | None
+
+    # compression codec ('zlib', 'lzma', 'bz2') of each store ('checkpoint': stagekit.pickle and stagekit.journal, 'data': data chunks)
+    # a codec can be given with its compression level, e.g. {checkpoint = 'zlib', data = ['lzma', 6]}
+    compression: Dict[str, str | list]
+
+    # where to save the state of workflows
+    # 'pickle': stagekit.pickle (and stagekit.journal if journal_size is set)
+    # 'sqlite': one row per stage in stagekit.db, updated when a stage changes
+    state_backend: Literal['pickle', 'sqlite']
+
+    # append stage updates to stagekit.journal and compact it into stagekit.pickle after a specific number of records
+    # None: save the whole workflow to stagekit.pickle on every checkpoint
+    journal_size: int | None
+
+    # run `stagekit gc` after the workflow is saved on exit
+    gc_on_exit: bool
+
+    # order of executing mpiexec tasks
+    # 'priority': higher priority and larger tasks first, smaller tasks run whenever resource is available
+    # 'backfill': smaller tasks only run ahead of a waiting task if they are estimated to finish before it can start
+    mpiexec_scheduler: Literal['priority', 'backfill']
+
+    # fail mpiexec tasks before execution if a percentile (e.g. 90) of the elapsed times of previous tasks
+    # with the same signature exceeds the remaining walltime of a time-limited job
+    # None or false: always execute tasks and only stop them when the walltime runs out
+    mpiexec_early_fail: int | float | None
+
+    # minimum number of successful previous tasks for mpiexec_early_fail to take effect
+    mpiexec_early_fail_samples: int
+
+    # number of threads for asynchronous file operations (Directory.aread(), Directory.adump(), etc.)
+    io_threads: int
+
     # interval of checking job status (in minutes)
     worker_update_interval: int | float
 
@@ -56,6 +102,18 @@ PATH_WORKSPACE = environ.get('STAGEKIT_CONFIG_WORKSPACE') or '.stagekit'
 config: Config = {
     'rerun_strategy': False,
     'data_chunk_size': None,
+    'data_mmap_size': 16,
+    'data_mmap_mode': 'r',
+    'data_verify': False,
+    'data_cache_mb': 256,
+    'compression': {},
+    'state_backend': 'pickle',
+    'journal_size': None,
+    'gc_on_exit': False,
+    'mpiexec_scheduler': 'priority',
+    'mpiexec_early_fail': None,
+    'mpiexec_early_fail_samples': 5,
+    'io_threads': 8,
     'worker_update_interval': 1,
     'modules': [
         'stagekit.jobs.local',
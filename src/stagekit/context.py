@@ -2,14 +2,14 @@ from __future__ import annotations
 
 from os import path
 from asyncio import sleep
-from traceback import format_exc
-from sys import stderr
 
 from .stage import Stage, current_stage
-from .directory import Directory, ws
+from .directory import Directory, to_io_thread
 from .subprocess.stat import stat
 from .config import config
-from .cache import load_cache
+from .cache import load_cache, save_cache, append_journal
+from .writer import writer
+from . import sqlite
 
 
 class Context(Directory):
@@ -64,7 +64,12 @@ class Context(Directory):
         if not current:
             raise RuntimeError('cannot set properties outside a running stage')
 
-        current.data[key] = val
+        if not current.data:
+            # replace shared empty data
+            current.data = {}
+
+        current.data[key] = val # type: ignore
+        current.touch()
 
     def setwd(self, cwd: str | None = None):
         """Set working directory.
@@ -76,7 +81,7 @@ class Context(Directory):
 
     async def checkpoint(self):
         """Save root stage to stagekit.pickle one second later."""
-        if self._saving or stat.in_subprocess:
+        if self._saving or stat.in_subprocess or config['state_backend'] != 'pickle' or config['journal_size']:
             return
 
         if stage := current_stage():
@@ -90,11 +95,37 @@ class Context(Directory):
             if self._saving:
                 self._save(stage)
 
+    def _update(self, stage: Stage):
+        """Record the state of a stage in journal mode or to database."""
+        if stat.in_subprocess:
+            return
+
+        if config['state_backend'] == 'sqlite':
+            sqlite.update(stage)
+            return
+
+        if not config['journal_size']:
+            return
+
+        if append_journal(stage) >= config['journal_size']:
+            root = stage
+
+            while root.parent:
+                root = root.parent
+
+            self._save(root)
+
     def _save(self, stage: Stage):
-        """Save a stage to stagekit.pickle."""
+        """Save a stage to stagekit.pickle in the background."""
         if stat.in_subprocess:
             return
 
+        if config['state_backend'] == 'sqlite':
+            # other stages are already saved by self._update()
+            sqlite.update(stage)
+            self._saving = False
+            return
+
         stages = load_cache()
         replaced = False
 
@@ -107,16 +138,10 @@ class Context(Directory):
         if not replaced:
             stages.insert(0, stage)
 
-        ws.dump(stages, '_stagekit.pickle')
-
-        try:
-            # verify saved state
-            assert ws.load('_stagekit.pickle') == stages
-
-        except Exception:
-            print(format_exc(), file=stderr)
-
-        else:
-            ws.mv('_stagekit.pickle', 'stagekit.pickle')
-
+        # only changed stages and their parent stages are serialized again (see tests/bench_checkpoint.py)
+        save_cache(stages)
         self._saving = False
+
+    async def flush(self):
+        """Wait until all checkpoints are written to disk."""
+        await to_io_thread(writer.flush)
@@ -1,22 +1,65 @@
 from __future__ import annotations
 from abc import ABC
-from typing import Type, Dict, Callable, Any, Tuple
+from typing import Type, Dict, List, Set, Callable, Any, Tuple, Iterable
+from collections import OrderedDict
+from functools import partial
+from weakref import ref
+from struct import Struct
+from array import array
+from os import path, fsync, replace
 
 from stagekit.directory import ws
 from stagekit.config import config
+from stagekit.writer import writer
+from stagekit import checksum
+from stagekit.io.pickle import dumps, loads, _align
 
 
-# dict of variable test function -> data class
+# dict of variable test function -> data class (tested in order for types not in _data_types)
 _data_cls: Dict[Callable[..., bool], Type[Data]] = {}
 
-# cache of data saved in separate files
-_data_cache: Dict[int, list] = {0: []}
+# data class of values whose type has a base class with given name (module.qualname)
+_data_types: Dict[str, Type[Data]] = {}
 
-# size of data cache
-_data_size: Dict[int, int] = {0: 0}
+# resolved data class of each type, _test if the test functions need to be called for each value
+_data_dispatch: Dict[type, Type[Data] | None | Callable] = {}
 
-# whether the latest data chunk has been updated
-_data_updated = False
+# builtin scalar types that are used as is without calling the test functions (only exact types)
+_scalar_types = {type(None), bool, int, float, complex, str, bytes}
+
+# header of a data chunk index (data#{idx}.idx): offset of each item in data#{idx}.bin
+_offset = Struct('<Q')
+
+# offset of an item removed by compact_chunk()
+_removed = 2 ** 64 - 1
+
+# entry of the digest index of a data chunk (data#{idx}.digest): checksum of each item in data#{idx}.bin
+_digest = Struct('<32s')
+
+# data that is not written to file yet, indexed by location
+_data_pending: Dict[Tuple[int, int] | str, Any] = {}
+
+# default value of _data_pending.get() (entries are removed by the writer thread, so checking before indexing is unsafe)
+_nodata = object()
+
+# offset tables of data chunks
+_data_offsets: Dict[int, array] = {}
+
+# data loaded from file and its size in bytes, indexed by location (or chunk index for chunks saved by an older version)
+# in order of last access, least recently used data is released when total size exceeds config['data_cache_mb']
+_data_cache: OrderedDict[Tuple[int, int] | int, Tuple[Any, int]] = OrderedDict()
+
+# total size of _data_cache in bytes
+_data_cache_size = 0
+
+# number of cache hits, misses and evictions of _data_cache
+_data_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+# index, number of items and size in bytes of the chunk that new data is appended to
+_data_chunk: List[int] | None = None
+
+# location of saved data indexed by checksum of its serialized content (built from data files on first save)
+_data_digests: Dict[bytes, Tuple[int, int]] | None = None
 
 
 class Data(ABC):
@@ -24,20 +67,31 @@ class Data(ABC):
     # raw data object
     _data: Any = None
 
-    # index of the data in _data_cache
-    location: Tuple[int, int] | None = None
+    # chunk index and item index of saved data (or file name in workspace if saved by a subclass)
+    location: Tuple[int, int] | str | None = None
+
+    # loaded data (not kept alive by self, so that it can be released by _data_cache)
+    _ref: ref | None = None
 
     @property
     def data(self) -> Any:
         """Data accessor (load from file if necessary)."""
-        if self.location and self._data is None:
-            idx = self.location[0]
-            if idx not in _data_cache or _data_size[idx] == 0:
-                _data_cache[idx], _data_size[idx] = ws.load(f'data#{idx}.pickle')
-            
-            self._data = _data_cache[idx][self.location[1]]
-        
-        return self._data
+        if self._data is not None or self.location is None:
+            return self._data
+
+        data = None if self._ref is None else self._ref()
+
+        if data is None:
+            data = self._load()
+
+            try:
+                self._ref = ref(data)
+
+            except TypeError:
+                # loaded again from _data_cache on next access
+                pass
+
+        return data
 
     @property
     def size(self) -> int:
@@ -46,42 +100,381 @@ class Data(ABC):
 
     def __init__(self, data):
         self._data = data
+
+    def _load(self) -> Any:
+        """Load data from file."""
+        return load_data(*self.location) # type: ignore
     
     def __getstate__(self):
-        global _data_updated
-
         if self.location is None:
-            size = self.size
-            idx = len(_data_cache) - 1
-            chunk = config['data_chunk_size']
+            self.location = _append(dumps(self.data), self.data)
 
-            if _data_size[idx] > 0 and chunk and size + _data_size[idx] > chunk * 1024 ** 2:
-                save_data()
-                idx += 1
-                _data_cache[idx] = []
-                _data_size[idx] = 0
+        return {'location': self.location}
 
-            self.location = idx, len(_data_cache[idx])
 
-            _data_cache[idx].append(self.data)
-            _data_size[idx] += size
-            _data_updated = True
+def define_data(test: Callable[..., bool], obj: Type, types: Iterable[type | str] = ()):
+    """Define a data wrapper.
 
-        return {'location': self.location}
+    Args:
+        test (Callable[..., bool]): Function to check whether a value should be wrapped (not called for builtin scalars and strings).
+        obj (Type): Data wrapper class.
+        types (Iterable[type | str], optional): Types (or names in the form of module.qualname) that are always wrapped
+            by obj without calling test, including their subclasses. Defaults to ().
+    """
+    _data_cls[test] = obj
 
+    for t in types:
+        _data_types[t if isinstance(t, str) else _typename(t)] = obj
 
-def define_data(test: Callable[..., bool], obj: Type):
-    """Define a data wrapper."""
-    _data_cls[test] = obj
+    _data_dispatch.clear()
+
+
+def find_data(val: Any) -> Type | None:
+    """Get the data wrapper of a value, None if the value is used as is."""
+    cls = type(val)
+
+    try:
+        data = _data_dispatch[cls]
+
+    except KeyError:
+        data = _data_dispatch[cls] = _resolve(cls)
+
+    if data is _test:
+        return _test(val)
+
+    return data
+
+
+def _resolve(cls: type) -> Type | None | Callable:
+    """Find data wrapper from the base classes of a type."""
+    if cls in _scalar_types:
+        return None
+
+    for base in cls.__mro__:
+        name = _typename(base)
+
+        if name in _data_types:
+            return _data_types[name]
+
+    return _test
+
+
+def _test(val: Any) -> Type | None:
+    """Find data wrapper by calling test functions in order of definition."""
+    for test, data in _data_cls.items():
+        if test(val):
+            return data
+
+    return None
+
+
+def _typename(cls: type) -> str:
+    return f'{cls.__module__}.{cls.__qualname__}'
 
 
 def save_data():
-    """Save cached stage data to file."""
-    global _data_updated
+    """Wait until stage data is written to file."""
+    writer.flush()
+
+
+def load_data(idx: int, i: int) -> Any:
+    """Load an item from a data chunk without reading other items.
+
+    Args:
+        idx (int): Chunk index.
+        i (int): Item index in the chunk.
+    """
+    data = _data_pending.get((idx, i), _nodata)
+
+    if data is not _nodata:
+        return data
+
+    if not ws.has(f'data#{idx}.bin'):
+        # saved by an older version
+        return _cached(idx, lambda: (ws.load(f'data#{idx}.pickle')[0], path.getsize(ws.path(f'data#{idx}.pickle'))))[i]
+
+    return _cached((idx, i), lambda: _read(idx, i))
+
+
+def cache_stats() -> Dict[str, int]:
+    """Get the number of hits, misses and evictions of loaded data, and the size of data currently cached (in bytes)."""
+    return {**_data_stats, 'size': _data_cache_size}
+
+
+def _cached(key: Tuple[int, int] | int, load: Callable[[], Tuple[Any, int]]) -> Any:
+    """Get data from _data_cache or load it and release least recently used data if out of budget."""
+    global _data_cache_size
+
+    if key in _data_cache:
+        _data_stats['hits'] += 1
+        _data_cache.move_to_end(key)
+
+        return _data_cache[key][0]
+
+    _data_stats['misses'] += 1
+    data, size = load()
+    budget = config['data_cache_mb']
+
+    if budget is None or budget is False:
+        limit = None
+
+    else:
+        limit = budget * 1024 ** 2
+
+        if size > limit:
+            # too large to be cached
+            return data
+
+    _data_cache[key] = data, size
+    _data_cache_size += size
+
+    while limit is not None and _data_cache_size > limit:
+        _, (_, s) = _data_cache.popitem(last=False)
+        _data_cache_size -= s
+        _data_stats['evictions'] += 1
+
+    return data
+
+
+def _read(idx: int, i: int) -> Tuple[Any, int]:
+    """Read an item and its size from a data chunk."""
+    if idx not in _data_offsets or i >= len(_data_offsets[idx]):
+        # offset table is reloaded if the item is appended after last load
+        _data_offsets[idx] = _read_offsets(idx)
+
+    with open(ws.path(f'data#{idx}.bin'), 'rb') as fb:
+        fb.seek(_data_offsets[idx][i])
+        view = checksum.load_mapped(fb)
+
+    # arrays saved out-of-band are copy-on-write views of the memory-mapped chunk
+    return loads(view), len(view)
+
+
+def _read_offsets(idx: int) -> array:
+    """Read the offset table of a data chunk (an incomplete last entry is ignored)."""
+    _recover(idx)
+    offsets = array('Q')
+
+    with open(ws.path(f'data#{idx}.idx'), 'rb') as f:
+        data = f.read()
+
+    offsets.frombytes(data[:len(data) - len(data) % _offset.size])
+
+    return offsets
+
+
+def _append(parts: List[bytes | memoryview], data: Any) -> Tuple[int, int]:
+    """Assign a location to serialized data and append it to the current chunk in the writer thread,
+        data with the same content as saved data is not saved again.
+        Out-of-band buffers in parts are views of data, which should not be modified until written."""
+    global _data_chunk, _data_digests
+
+    if _data_chunk is None:
+        _data_chunk = _last_chunk()
+
+    if _data_digests is None:
+        _data_digests = _read_digests(_data_chunk[0])
+
+    digest = checksum.digest(parts)
+    nbytes = sum(len(part) for part in parts)
+
+    if digest in _data_digests:
+        return _data_digests[digest]
+
+    # checked before the item is registered, so that an invalid codec does not leave an item that is never written
+    codec = checksum.compression('data')
+    idx, count, size = _data_chunk
+    chunk = config['data_chunk_size']
+
+    if count > 0 and chunk and size + nbytes > chunk * 1024 ** 2:
+        # start a new chunk
+        idx, count, size = idx + 1, 0, 0
+
+    _data_chunk = [idx, count + 1, size + nbytes]
+    _data_pending[idx, count] = data
+    _data_digests[digest] = idx, count
+
+    writer.submit(partial(_write, idx, count, parts, digest, codec), keep=True)
+
+    return idx, count
+
+
+def _last_chunk() -> List[int]:
+    """Find the chunk to append new data to from saved files."""
+    idx = -1
+
+    for name in ws.ls(grep='data#*'):
+        try:
+            idx = max(idx, int(name[5:].split('.')[0]))
+
+        except ValueError:
+            pass
+
+    if idx < 0 or not ws.has(f'data#{idx}.idx'):
+        # do not append to a chunk saved by an older version
+        return [idx + 1, 0, 0]
+
+    return [idx, len(_read_offsets(idx)), path.getsize(ws.path(f'data#{idx}.bin'))]
+
+
+def _read_digests(last: int) -> Dict[bytes, Tuple[int, int]]:
+    """Read checksums of saved items in data chunks up to the last one from their digest indices,
+        items without an entry (saved by an older version) are read from their headers."""
+    digests = {}
+
+    for idx in range(last + 1):
+        if not ws.has(f'data#{idx}.idx'):
+            continue
+
+        saved = ws.path(f'data#{idx}.digest')
+        table = b''
+
+        if path.exists(saved):
+            with open(saved, 'rb') as f:
+                table = f.read()
+
+        # items whose digest is not in the digest index
+        missing = []
+
+        for i, offset in enumerate(_read_offsets(idx)):
+            if offset == _removed:
+                continue
+
+            # entries of items appended to a chunk saved by an older version are preceded by zeros
+            digest = table[i * _digest.size: (i + 1) * _digest.size]
+
+            if len(digest) == _digest.size and any(digest):
+                digests.setdefault(digest, (idx, i))
+
+            else:
+                missing.append((i, offset))
+
+        if missing:
+            with open(ws.path(f'data#{idx}.bin'), 'rb') as fb:
+                for i, offset in missing:
+                    fb.seek(offset)
+
+                    if digest := checksum.peek(fb):
+                        digests.setdefault(digest, (idx, i))
+
+    return digests
+
+
+def _write(idx: int, i: int, parts: List[bytes | memoryview], digest: bytes | None = None,
+           codec: Tuple[str | None, int | None] = (None, None)):
+    """Append an item to data#{idx}.bin and its offset to data#{idx}.idx."""
+    if not ws.has():
+        ws.mkdir()
+
+    if digest is None:
+        digest = checksum.digest(parts)
+
+    with open(ws.path(f'data#{idx}.bin'), 'ab') as fb:
+        # aligned so that out-of-band buffers are aligned in the memory map when loaded
+        offset = checksum.dump(parts, fb, digest, *codec, _align)
+        fb.flush()
+        fsync(fb.fileno())
+
+    # the offset is written last, entries of an item that was not completely written are overwritten
+    _write_entry(f'data#{idx}.digest', i, _digest.pack(digest))
+    _write_entry(f'data#{idx}.idx', i, _offset.pack(offset))
+
+    del _data_pending[idx, i]
+
+
+def _write_entry(dst: str, i: int, entry: bytes):
+    """Write the entry of the i-th item to an index file of a data chunk and remove entries after it."""
+    with open(ws.path(dst), 'r+b' if ws.has(dst) else 'wb') as f:
+        f.seek(i * len(entry))
+        f.write(entry)
+        f.truncate()
+        f.flush()
+        fsync(f.fileno())
+
+
+def compact_chunk(idx: int, live: Set[int]) -> int:
+    """Remove items that are not in use from a data chunk, locations of remaining items are unchanged.
+
+    Args:
+        idx (int): Chunk index.
+        live (Set[int]): Indices of items in use.
+
+    Returns:
+        int: Number of bytes reclaimed.
+    """
+    _data_offsets.pop(idx, None)
+
+    if not ws.has(f'data#{idx}.bin'):
+        # saved by an older version, removed items are replaced by None
+        src = f'data#{idx}.pickle'
+        size = path.getsize(ws.path(src))
+        items, nbytes = ws.load(src)
+
+        if all(i in live for i in range(len(items))):
+            return 0
+
+        if not live:
+            ws.rm(src)
+            return size
+
+        ws.dump(([item if i in live else None for i, item in enumerate(items)], nbytes), src)
+
+        return size - path.getsize(ws.path(src))
+
+    offsets = _read_offsets(idx)
+    size = path.getsize(ws.path(f'data#{idx}.bin')) + path.getsize(ws.path(f'data#{idx}.idx'))
+
+    if not any(i in live for i in range(len(offsets))):
+        ws.rm(f'data#{idx}.bin')
+        ws.rm(f'data#{idx}.idx')
+
+        if ws.has(f'data#{idx}.digest'):
+            size += path.getsize(ws.path(f'data#{idx}.digest'))
+            ws.rm(f'data#{idx}.digest')
+
+        return size
+
+    if all(i in live or offsets[i] == _removed for i in range(len(offsets))):
+        return 0
+
+    # an item extends to the start of the next item (or the end of file)
+    starts = sorted(o for o in offsets if o != _removed)
+    ends = dict(zip(starts, starts[1:]))
+    compacted = array('Q')
+
+    with open(ws.path(f'data#{idx}.bin'), 'rb') as src, open(ws.path(f'data#{idx}.bin.new'), 'wb') as dst:
+        for i, offset in enumerate(offsets):
+            if i not in live or offset == _removed:
+                compacted.append(_removed)
+                continue
+
+            # items keep their alignment in file
+            src.seek(offset)
+            dst.write(b'\0' * ((offset - dst.tell()) % _align))
+            compacted.append(dst.tell())
+            dst.write(src.read(ends[offset] - offset) if offset in ends else src.read())
+
+        dst.flush()
+        fsync(dst.fileno())
+
+    # new offset table is written last, so that an interrupted compaction can be completed by _recover()
+    with open(ws.path(f'data#{idx}.idx.new'), 'wb') as f:
+        f.write(compacted.tobytes())
+        f.flush()
+        fsync(f.fileno())
+
+    _recover(idx)
+
+    return size - path.getsize(ws.path(f'data#{idx}.bin')) - path.getsize(ws.path(f'data#{idx}.idx'))
+
+
+def _recover(idx: int):
+    """Complete or discard an interrupted compaction of a data chunk."""
+    if ws.has(f'data#{idx}.idx.new'):
+        if ws.has(f'data#{idx}.bin.new'):
+            replace(ws.path(f'data#{idx}.bin.new'), ws.path(f'data#{idx}.bin'))
 
-    idx = len(_data_cache) - 1
+        replace(ws.path(f'data#{idx}.idx.new'), ws.path(f'data#{idx}.idx'))
 
-    if _data_updated:
-        _data_updated = False
-        print(f'data#{idx} saved: {_data_size[idx]/1024**2:.2f}MB')
-        ws.dump((_data_cache[idx], _data_size[idx]), f'data#{idx}.pickle')
+    elif ws.has(f'data#{idx}.bin.new'):
+        ws.rm(f'data#{idx}.bin.new')
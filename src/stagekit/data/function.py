@@ -1,5 +1,7 @@
 from __future__ import annotations
+from typing import Dict, Tuple
 from sys import path
+from types import FunctionType, BuiltinFunctionType, MethodType
 from os.path import dirname, basename, splitext
 from importlib import import_module
 import __main__
@@ -14,6 +16,9 @@ def test(func):
 # extra paths to be imported for functions
 inserted_paths = {}
 
+# Function objects shared by stages, indexed by (module, name, path)
+_interned: Dict[Tuple[str, str, str | None], Function] = {}
+
 
 class Function:
     """Wrapper for Python functions replacing __main__ with absolute path for pickle."""
@@ -47,6 +52,10 @@ class Function:
         
         return False
     
+    def __reduce__(self):
+        # restore as a shared object
+        return (intern, (self.module, self.name, self.path))
+
     def load(self):
         if self.path and self.path not in path:
             path.insert(1, self.path)
@@ -55,4 +64,17 @@ class Function:
         return getattr(import_module(self.module), self.name)
 
 
-define_data(test, Function)
+def intern(module: str, name: str, path: str | None) -> Function:
+    """Get a shared Function object."""
+    key = (module, name, path)
+
+    if key not in _interned:
+        func = _interned[key] = Function.__new__(Function)
+        func.module = module
+        func.name = name
+        func.path = path
+
+    return _interned[key]
+
+
+define_data(test, Function, (FunctionType, BuiltinFunctionType, MethodType, type))
@@ -1,31 +1,152 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
+from sys import modules
+from os import fsync, replace
+from hashlib import blake2b
+import pickle
 
-from .data import define_data, Data
+from stagekit.directory import ws
+from stagekit.config import config
+from stagekit.writer import writer
+from .data import define_data, Data, _data_pending, _nodata
 
 if TYPE_CHECKING:
     import numpy as np
 
 
 def test(arr):
-    import numpy as np
+    # numpy is not imported unless already used
+    np = modules.get('numpy')
 
-    return isinstance(arr, np.ndarray)
+    return np is not None and isinstance(arr, np.ndarray)
 
 
 class Numpy(Data):
-    """Wrapper for numpy arrays."""
+    """Wrapper for numpy arrays, large arrays are saved as .npy files and memory-mapped when loaded."""
     data: np.ndarray
-    
+
+    # data type of the array (as numpy.dtype.str)
+    _dtype: str | None = None
+
+    # shape of the array
+    _shape: tuple | None = None
+
+    # digest of array content
+    _digest: str | None = None
+
+    @property
+    def dtype(self) -> str:
+        """Data type of the array."""
+        if self._dtype is None:
+            self._dtype = self.data.dtype.str
+
+        return self._dtype
+
+    @property
+    def shape(self) -> tuple:
+        """Shape of the array."""
+        if self._shape is None:
+            self._shape = self.data.shape
+
+        return self._shape
+
+    @property
+    def digest(self) -> str:
+        """Digest of array content, computed once and saved with the wrapper."""
+        if self._digest is None:
+            self._digest = _digest(self.data)
+
+        return self._digest
+
+    def _load(self):
+        if isinstance(self.location, str):
+            arr = _data_pending.get(self.location, _nodata)
+
+            if arr is not _nodata:
+                return arr
+
+            import numpy as np
+
+            # memory-mapped arrays are not counted in data cache
+            return np.load(ws.path(self.location), mmap_mode=config['data_mmap_mode'])
+
+        return super()._load()
+
     @property
     def size(self):
         return self.data.nbytes
 
+    def __getstate__(self):
+        mmap = config['data_mmap_size']
+
+        if self.location is None and mmap is not None and mmap is not False and self.size >= mmap * 1024 ** 2 and _mappable(self.data):
+            self.location = _save(self.data, self.dtype, self.shape, self.digest)
+
+        state = super().__getstate__()
+        state['_dtype'] = self.dtype
+        state['_shape'] = self.shape
+        state['_digest'] = self.digest
+
+        return state
+
     def __eq__(self, other: Numpy):
         if not isinstance(other, Numpy):
             return False
 
-        return all(self.data == other.data)
+        if self.dtype != other.dtype or self.shape != other.shape or self.digest != other.digest:
+            return False
+
+        if config['data_verify']:
+            import numpy as np
+
+            return np.array_equal(self.data, other.data)
+
+        return True
+
+
+def _digest(arr: np.ndarray) -> str:
+    """Compute the digest of array content."""
+    import numpy as np
+
+    if arr.dtype.hasobject:
+        # object arrays contain pointers
+        return blake2b(pickle.dumps(arr.tolist()), digest_size=16).hexdigest()
+
+    return blake2b(np.ascontiguousarray(arr).data, digest_size=16).hexdigest()
+
+
+def _mappable(arr: np.ndarray) -> bool:
+    """Check if an array can be saved as .npy file without losing information (e.g. mask of a masked array)."""
+    import numpy as np
+
+    return type(arr) in (np.ndarray, np.memmap) and not arr.dtype.hasobject
+
+
+def _save(arr: np.ndarray, dtype: str, shape: tuple, digest: str) -> str:
+    """Save an array as a .npy file named by its content in the writer thread
+        (arrays are not copied and should not be modified after used as stage arguments)."""
+    dst = f'array#{blake2b(repr((dtype, shape, digest)).encode(), digest_size=16).hexdigest()}.npy'
+
+    if dst not in _data_pending and not ws.has(dst):
+        _data_pending[dst] = arr
+        writer.submit(lambda: _write(arr, dst), keep=True)
+
+    return dst
+
+
+def _write(arr: np.ndarray, dst: str):
+    import numpy as np
+
+    if not ws.has():
+        ws.mkdir()
+
+    with open(ws.path(dst + '.tmp'), 'wb') as fb:
+        np.save(fb, arr)
+        fb.flush()
+        fsync(fb.fileno())
+
+    replace(ws.path(dst + '.tmp'), ws.path(dst))
+    del _data_pending[dst]
 
 
-define_data(test, Numpy)
+define_data(test, Numpy, ('numpy.ndarray',))
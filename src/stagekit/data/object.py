@@ -3,8 +3,12 @@ from __future__ import annotations
 from .function import Function, define_data
 
 
+# builtin types that are used as is (only exact types, subclasses may have extra state)
+_plain_types = {type(None), bool, int, float, complex, str, bytes, list, tuple, dict, set, frozenset, range, slice}
+
+
 def test(obj):
-    return obj.__getstate__() is not None
+    return type(obj) not in _plain_types and obj.__getstate__() is not None
 
 
 class Object:
@@ -1,17 +1,29 @@
 from __future__ import annotations
-
-from os import path, fsync
-from subprocess import check_call
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from os import path, fsync, makedirs, remove, replace, symlink, getcwd
+from errno import EINVAL, ENOENT
+from shutil import rmtree, copy, copytree, move
 from glob import glob
-from typing import List, Collection, Awaitable, Any, Callable, Literal, Tuple, TYPE_CHECKING
+from typing import List, Set, Collection, Awaitable, Any, Callable, Literal, Tuple, TypeVar, TYPE_CHECKING
 
 from .io.io import get_io
-from .config import PATH_WORKSPACE
+from .config import config, PATH_WORKSPACE
 
 if TYPE_CHECKING:
     from .mpiexec import MPIOutput
 
 
+# absolute paths of directories known to exist (created by or checked in Directory.mkdir())
+_known_dirs: Set[str] = set()
+
+# thread pool of asynchronous file operations (created on first use with config['io_threads'] threads)
+_executor: ThreadPoolExecutor | None = None
+
+T = TypeVar('T')
+
+
 class Directory:
     """Utility for directory operation."""
     # working directory relative to root directory
@@ -86,11 +98,11 @@ class Directory:
         return call(cmd, cwd)
 
     def mpiexec(self, cmd: str | Callable,
-            nprocs: int = 1, cpus_per_proc: int = 1, gpus_per_proc: int | Tuple[Literal[1], int] = 0, *,
+            nprocs: int = 1, cpus_per_proc: int = 1, gpus_per_proc: int | Tuple[Literal[1], int] = 0, *, mem_per_proc: float = 0,
             multiprocessing: bool = False, custom_exec: str | None = None, custom_nnodes: int | Tuple[int, int] | None = None,
             args: Collection | None = None, mpiargs: Collection | None = None, fname: str | None = None,
             check_output: Callable[..., None] | None = None, timeout: Literal['auto'] | float | None = 'auto',
-            priority: int = 0) -> Awaitable[MPIOutput]:
+            priority: int = 0, duration: float | None = None) -> Awaitable[MPIOutput]:
         """Execute a function or shell command with MPI or multiprocessing.
 
         Args:
@@ -98,6 +110,7 @@ class Directory:
             nprocs (int, optional): Number of MPI processes. Defaults to 1.
             cpus_per_proc (int, optional): Number of CPUs per MPI processes. Defaults to 1.
             gpus_per_proc (int | Tuple[Literal[1], int], optional): Number of GPUs per MPI processes, use (1,n) for MPS (use one GPU for multiple MPI processes). Defaults to 0.
+            mem_per_proc (float, optional): Memory (in GB) per process, only used for scheduling if job.mem_per_node is set. Defaults to 0.
             multiprocessing (bool, optional): Use multiprocessing instead of MPI. Defaults to False.
             custom_exec (str | None, optional): Custom command to call MPI tasks. Defaults to None.
             custom_nnodes (int | Tuple[int, int] | None, optional): Specify the number of nodes if custom_exec is enabled. Defaults to None.
@@ -107,21 +120,49 @@ class Directory:
             check_output (Callable[..., None] | None): Check the output of stdout and/or stderr and determine if task succeeded.
             timeout (Literal['auto'] | float | None): Action when running out of walltime.
             priority (int | None, optional): Priority of the job execution. Defaults to None.
+            duration (float | None, optional): Estimated execution time (in seconds) for backfill scheduling,
+                None to estimate from previous tasks with the same command. Defaults to None.
         """
         from .mpiexec import mpiexec
 
+        # arguments added in later versions are only passed if set, so that saved mpiexec stages still match
+        kwargs = {}
+
+        if mem_per_proc:
+            kwargs['mem_per_proc'] = mem_per_proc
+
+        if duration is not None:
+            kwargs['duration'] = duration
+
         return mpiexec(cmd, nprocs, cpus_per_proc, gpus_per_proc,
             cwd=self.cwd, multiprocessing=multiprocessing,
             custom_exec=custom_exec, custom_nnodes=custom_nnodes, args=args, mpiargs=mpiargs, fname=fname,
-            check_output=check_output, timeout=timeout, priority=priority)
+            check_output=check_output, timeout=timeout, priority=priority, **kwargs)
 
     def rm(self, src: str = '.'):
         """Remove a file or a directory.
 
         Args:
-            src (str, optional): Relative path to the file or directory. Defaults to '.'.
+            src (str, optional): Relative path (or glob pattern) to the file or directory. Defaults to '.'.
+
+        Raises:
+            OSError: src is the current working directory of the process or one of its parents (refused as `rm -rf .` does).
         """
-        check_call('rm -rf ' + self.path(src), shell=True)
+        entries = self._glob(src)
+        cwd = path.join(getcwd(), '')
+
+        # check all entries before removing any of them
+        for entry in entries:
+            if cwd.startswith(path.join(path.abspath(entry), '')):
+                raise OSError(EINVAL, 'refusing to remove current working directory', entry)
+
+        for entry in entries:
+            if path.isdir(entry) and not path.islink(entry):
+                _forget(entry)
+                rmtree(entry)
+
+            else:
+                remove(entry)
     
     def cp(self, src: str, dst: str = '.', *, mkdir: bool = True):
         """Copy file or a directory.
@@ -130,24 +171,65 @@ class Directory:
             src (str): Relative path to the file or directory to be copied.
             dst (str, optional): Relative path to the destination directory. Defaults to '.'.
             mkdir (bool, optional): Whether or not create a new directory if dst does not exist. Defaults to True.
+
+        Raises:
+            FileNotFoundError: src does not exist or matches nothing.
         """
         if mkdir:
             self.mkdir(path.dirname(dst))
 
-        check_call(f'cp -r {self.path(src)} {self.path(dst)}', shell=True)
+        entries = self._glob(src, True)
+
+        def cp():
+            for entry in entries:
+                target = self.path(dst)
+
+                if path.isdir(target):
+                    target = path.join(target, path.basename(entry))
+
+                if path.isdir(entry) and not path.islink(entry):
+                    copytree(entry, target, symlinks=True, dirs_exist_ok=True)
+
+                else:
+                    copy(entry, target, follow_symlinks=False)
+
+        self._retry(cp, path.dirname(dst), mkdir)
     
     def mv(self, src: str, dst: str = '.', *, mkdir: bool = True):
-        """Move a file or a directory.
+        """Move a file or a directory (replaces dst atomically if it is not a directory).
 
         Args:
             src (str): Relative path to the file or directory to be moved.
             dst (str, optional): Relative path to the destination directory. Defaults to '.'.
             mkdir (bool, optional): Whether or not create a new directory if dst does not exist. Defaults to True.
+
+        Raises:
+            FileNotFoundError: src does not exist or matches nothing.
         """
         if mkdir:
             self.mkdir(path.dirname(dst))
 
-        check_call(f'mv {self.path(src)} {self.path(dst)}', shell=True)
+        entries = self._glob(src, True)
+
+        def mv():
+            for entry in entries:
+                target = self.path(dst)
+
+                if path.isdir(entry):
+                    _forget(entry)
+
+                if path.isdir(target):
+                    move(entry, path.join(target, path.basename(entry)))
+
+                else:
+                    try:
+                        replace(entry, target)
+
+                    except OSError:
+                        # different file systems
+                        move(entry, target)
+
+        self._retry(mv, path.dirname(dst), mkdir)
     
     def ln(self, src: str, dst: str = '.', mkdir: bool = True):
         """Link a file or a directory.
@@ -157,6 +239,13 @@ class Directory:
             dst (str, optional): Relative path to the destination directory. Defaults to '.'.
             mkdir (bool, optional): Whether or not create a new directory if dst does not exist. Defaults to True.
         """
+        if any(c in src for c in '*?['):
+            # link every match of a glob pattern, keeping src relative if it is relative
+            for entry in self._glob(src):
+                self.ln(entry if path.isabs(src) else path.relpath(entry, self.path()), dst, mkdir)
+
+            return
+
         # source file name
         srcdir = path.dirname(src) or '.'
         srcf = path.basename(src)
@@ -165,7 +254,7 @@ class Directory:
         if self.isdir(dst):
             self.rm(path.join(dst, srcf))
             dstdir = dst
-            dstf = '.'
+            dstf = srcf
         
         else:
             self.rm(dst)
@@ -185,15 +274,52 @@ class Directory:
                 # convert src to abspath if dst is abspath
                 src = self.abspath(src)
 
-        check_call(f'ln -s {src} {dstf}', shell=True, cwd=self.path(dstdir))
+        self._retry(lambda: symlink(src, self.path(dstdir, dstf)), dstdir, mkdir)
     
-    def mkdir(self, dst: str = '.'):
+    def mkdir(self, dst: str = '.', *, cached: bool = True):
         """Create a new directory recursively.
 
         Args:
             dst (str, optional): Relative path to the directory to be created. Defaults to '.'.
+            cached (bool, optional): Skip if the directory is known to exist. Defaults to True.
+        """
+        target = self.abspath(dst)
+
+        if not cached or target not in _known_dirs:
+            makedirs(target, exist_ok=True)
+            _known_dirs.add(target)
+
+    def _retry(self, func: Callable[[], T], dstdir: str, mkdir: bool) -> T:
+        """Call func again after creating dstdir if dstdir was removed by another process (cached by mkdir())."""
+        try:
+            return func()
+
+        except FileNotFoundError:
+            if not mkdir:
+                raise
+
+            self.mkdir(dstdir, cached=False)
+
+            return func()
+
+    def _glob(self, src: str, strict: bool = False) -> List[str]:
+        """Get existing paths matching a relative path or glob pattern.
+
+        Raises:
+            FileNotFoundError: Nothing matches src and strict is True.
         """
-        check_call('mkdir -p ' + self.path(dst), shell=True)
+        target = self.path(src)
+
+        if any(c in src for c in '*?['):
+            entries = glob(target)
+
+        else:
+            entries = [target] if path.lexists(target) else []
+
+        if strict and not entries:
+            raise FileNotFoundError(ENOENT, 'No such file or directory', target)
+
+        return entries
     
     def ls(self, src: str = '.', grep: str = '*', isdir: bool | None = None) -> List[str]:
         """List items in a directory.
@@ -257,7 +383,7 @@ class Directory:
         if mkdir:
             self.mkdir(path.dirname(dst))
 
-        with open(self.path(dst), mode) as f:
+        with self._retry(lambda: open(self.path(dst), mode), path.dirname(dst), mkdir) as f:
             f.write(text)
             f.flush()
             fsync(f.fileno())
@@ -321,8 +447,100 @@ class Directory:
 
         if ext is None:
             ext = dst.split('.')[-1]
-        
-        return get_io(ext).dump(obj, self.path(dst))
+
+        io = get_io(ext)
+
+        return self._retry(lambda: io.dump(obj, self.path(dst)), path.dirname(dst), mkdir)
+
+    def ahas(self, src: str = '.') -> Awaitable[bool]:
+        """Asynchronous version of has()."""
+        return self._io('has', src)
+
+    def arm(self, src: str = '.') -> Awaitable[None]:
+        """Asynchronous version of rm()."""
+        return self._io('rm', src)
+
+    def acp(self, src: str, dst: str = '.', *, mkdir: bool = True) -> Awaitable[None]:
+        """Asynchronous version of cp()."""
+        return self._io('cp', src, dst, mkdir=mkdir)
+
+    def amv(self, src: str, dst: str = '.', *, mkdir: bool = True) -> Awaitable[None]:
+        """Asynchronous version of mv()."""
+        return self._io('mv', src, dst, mkdir=mkdir)
+
+    def aln(self, src: str, dst: str = '.', mkdir: bool = True) -> Awaitable[None]:
+        """Asynchronous version of ln()."""
+        return self._io('ln', src, dst, mkdir)
+
+    def amkdir(self, dst: str = '.', *, cached: bool = True) -> Awaitable[None]:
+        """Asynchronous version of mkdir()."""
+        return self._io('mkdir', dst, cached=cached)
+
+    def als(self, src: str = '.', grep: str = '*', isdir: bool | None = None) -> Awaitable[List[str]]:
+        """Asynchronous version of ls()."""
+        return self._io('ls', src, grep, isdir)
+
+    def aisdir(self, src: str = '.') -> Awaitable[bool]:
+        """Asynchronous version of isdir()."""
+        return self._io('isdir', src)
+
+    def aread(self, src: str) -> Awaitable[str]:
+        """Asynchronous version of read()."""
+        return self._io('read', src)
+
+    def awrite(self, text: str, dst: str, mode: str = 'w', *, mkdir: bool = True) -> Awaitable[None]:
+        """Asynchronous version of write()."""
+        return self._io('write', text, dst, mode, mkdir=mkdir)
+
+    def areadlines(self, src: str) -> Awaitable[List[str]]:
+        """Asynchronous version of readlines()."""
+        return self._io('readlines', src)
+
+    def awritelines(self, lines: Collection[str], dst: str, mode: str = 'w', *, mkdir: bool = True) -> Awaitable[None]:
+        """Asynchronous version of writelines()."""
+        return self._io('writelines', lines, dst, mode, mkdir=mkdir)
+
+    def aload(self, src: str, ext: str | None = None) -> Awaitable[Any]:
+        """Asynchronous version of load()."""
+        return self._io('load', src, ext)
+
+    def adump(self, obj, dst: str, ext: str | None = None, *, mkdir: bool = True) -> Awaitable[None]:
+        """Asynchronous version of dump()."""
+        return self._io('dump', obj, dst, ext, mkdir=mkdir)
+
+    def _io(self, method: str, *args, **kwargs) -> Awaitable[Any]:
+        """Call a method in the I/O thread pool."""
+        # cwd of a context depends on the running stage, resolve it before leaving the event loop
+        target = Directory()
+        target._cwd = self.cwd
+
+        return to_io_thread(getattr(target, method), *args, **kwargs)
+
+
+def to_io_thread(func: Callable[..., T], *args, **kwargs) -> Awaitable[T]:
+    """Run a blocking function in the I/O thread pool without blocking the event loop.
+
+    Args:
+        func (Callable[..., T]): Function to run.
+        *args: Positional arguments of func.
+        **kwargs: Keyword arguments of func.
+    """
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(config['io_threads'], 'stagekit-io')
+
+    return asyncio.get_running_loop().run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+def _forget(src: str):
+    """Remove a directory and its subdirectories from _known_dirs."""
+    src = path.abspath(src)
+    prefix = path.join(src, '')
+
+    # copy with list() because other threads may add entries
+    for d in [d for d in list(_known_dirs) if d == src or d.startswith(prefix)]:
+        _known_dirs.discard(d)
 
 
 # reference to root directory
@@ -0,0 +1,194 @@
+from __future__ import annotations
+from typing import List, Dict, Callable, Tuple, Literal
+from functools import partial
+from fractions import Fraction
+from struct import Struct
+from math import floor, ceil
+from os import fsync
+
+from .directory import ws
+from .writer import writer
+
+
+# file in workspace that records the resource request and elapsed time of finished mpiexec tasks
+PATH_HISTORY = 'stagekit.history'
+
+# fixed part of a record: nprocs, cpus_per_proc, gpus_per_proc, multiprocessing, nnodes,
+# submission time, time waited in queue, elapsed time, success, length of name
+_record = Struct('<IIdBddddBH')
+
+# records loaded from PATH_HISTORY and added by this process, signature -> records (None if not loaded)
+_records: Dict[str, List[Record]] | None = None
+
+
+class Record:
+    """Resource request and elapsed time of an mpiexec task."""
+    __slots__ = ['name', 'nprocs', 'cpus_per_proc', 'gpus_per_proc', 'multiprocessing', 'nnodes',
+                 'submitted', 'wait', 'elapsed', 'success']
+
+    # command or function executed (return value of identity())
+    name: str
+
+    # number of processes
+    nprocs: int
+
+    # number of CPUs per process
+    cpus_per_proc: int
+
+    # number of GPUs per process (less than 1 for processes sharing a GPU with MPS)
+    gpus_per_proc: float
+
+    # task was executed with multiprocessing
+    multiprocessing: bool
+
+    # resource used by the scheduler (number of nodes for MPI tasks, number of CPUs for multiprocessing tasks)
+    nnodes: float
+
+    # time when the task was submitted
+    submitted: float
+
+    # time (in seconds) waited for resources
+    wait: float
+
+    # time (in seconds) of execution
+    elapsed: float
+
+    # task finished without error
+    success: bool
+
+    def __init__(self, name: str, nprocs: int, cpus_per_proc: int, gpus_per_proc: float, multiprocessing: bool,
+                 nnodes: float, submitted: float, wait: float, elapsed: float, success: bool):
+        self.name = name
+        self.nprocs = nprocs
+        self.cpus_per_proc = cpus_per_proc
+        self.gpus_per_proc = gpus_per_proc
+        self.multiprocessing = multiprocessing
+        self.nnodes = nnodes
+        self.submitted = submitted
+        self.wait = wait
+        self.elapsed = elapsed
+        self.success = success
+
+    @property
+    def signature(self) -> str:
+        """Tasks with the same signature are expected to have similar elapsed time."""
+        return signature(self.name, self.nprocs, self.cpus_per_proc, self.gpus_per_proc)
+
+
+def identity(cmd: str | Callable) -> str:
+    """Name of a shell command or function in records."""
+    if isinstance(cmd, str):
+        return cmd
+
+    return f'{getattr(cmd, "__module__", None)}:{getattr(cmd, "__qualname__", None)}'
+
+
+def gpus(gpus_per_proc: int | Tuple[Literal[1], int]) -> float:
+    """Number of GPUs per process from the gpus_per_proc argument of mpiexec."""
+    if isinstance(gpus_per_proc, tuple):
+        return float(Fraction(gpus_per_proc[0], gpus_per_proc[1]))
+
+    return float(gpus_per_proc)
+
+
+def signature(name: str, nprocs: int, cpus_per_proc: int, gpus_per_proc: float) -> str:
+    """Identity of a task whose previous records are used to estimate its elapsed time.
+
+    Args:
+        name (str): Return value of identity().
+        nprocs (int): Number of processes.
+        cpus_per_proc (int): Number of CPUs per process.
+        gpus_per_proc (float): Return value of gpus().
+    """
+    return f'{name} nprocs={nprocs} cpus={cpus_per_proc} gpus={gpus_per_proc:g}'
+
+
+def record(rec: Record):
+    """Add a record and append it to PATH_HISTORY in the writer thread."""
+    records().append(rec)
+    _records.setdefault(rec.signature, []).append(rec) # type: ignore
+
+    name = rec.name.encode()[:65535]
+    blob = _record.pack(rec.nprocs, rec.cpus_per_proc, rec.gpus_per_proc, rec.multiprocessing, rec.nnodes,
+                        rec.submitted, rec.wait, rec.elapsed, rec.success, len(name)) + name
+
+    writer.submit(partial(_append, blob), keep=True)
+
+
+def records(sig: str | None = None) -> List[Record]:
+    """Records of finished tasks in current workspace.
+
+    Args:
+        sig (str | None, optional): Only get records with a signature (return value of signature()). Defaults to None.
+    """
+    global _records
+
+    if _records is None:
+        _records = {'': _load()}
+
+        for rec in _records['']:
+            _records.setdefault(rec.signature, []).append(rec)
+
+    return _records.get('' if sig is None else sig, [])
+
+
+def estimate(sig: str, q: float = 50, min_samples: int = 1) -> float | None:
+    """Estimate the elapsed time (in seconds) of a task from successful tasks with the same signature.
+
+    Args:
+        sig (str): Return value of signature().
+        q (float, optional): Percentile of previous elapsed times (50 for median). Defaults to 50.
+        min_samples (int, optional): Minimum number of successful tasks to estimate from. Defaults to 1.
+
+    Returns:
+        float | None: Estimated elapsed time, None if fewer tasks with the signature have finished.
+    """
+    elapsed = sorted(rec.elapsed for rec in records(sig) if rec.success)
+
+    if not elapsed or len(elapsed) < min_samples:
+        return None
+
+    # linear interpolation between closest ranks
+    pos = (len(elapsed) - 1) * min(max(q, 0), 100) / 100
+    lo, hi = floor(pos), ceil(pos)
+
+    return elapsed[lo] + (elapsed[hi] - elapsed[lo]) * (pos - lo)
+
+
+def _load() -> List[Record]:
+    """Read records from PATH_HISTORY."""
+    if not ws.has(PATH_HISTORY):
+        return []
+
+    with open(ws.path(PATH_HISTORY), 'rb') as fb:
+        data = fb.read()
+
+    recs = []
+    offset = 0
+
+    # incomplete record at the end (interrupted write) is ignored
+    while offset + _record.size <= len(data):
+        *fields, size = _record.unpack_from(data, offset)
+        offset += _record.size
+
+        if offset + size > len(data):
+            break
+
+        name = data[offset: offset + size].decode(errors='replace')
+        offset += size
+
+        nprocs, cpus_per_proc, gpus_per_proc, mp, nnodes, submitted, wait, elapsed, success = fields
+        recs.append(Record(name, nprocs, cpus_per_proc, gpus_per_proc, bool(mp), nnodes, submitted, wait, elapsed, bool(success)))
+
+    return recs
+
+
+def _append(blob: bytes):
+    """Append a record to PATH_HISTORY."""
+    if not ws.has():
+        ws.mkdir()
+
+    with open(ws.path(PATH_HISTORY), 'ab') as fb:
+        fb.write(blob)
+        fb.flush()
+        fsync(fb.fileno())
@@ -1,21 +1,113 @@
+from __future__ import annotations
+from typing import Any, List
+from struct import Struct
+from mmap import mmap, ACCESS_COPY
+from os import path, getpid, remove, replace
+from threading import get_ident
+import pickle
+
 from .io import IO, define_io
 
 
-class Pickle(IO):
-    def __init__(self):
-        from pickle import load, dump
+# identifier of a pickle file with out-of-band buffers
+MAGIC = b'SKP5'
+
+# header: magic, length of pickle stream, number of out-of-band buffers
+_header = Struct('<4sQQ')
+
+# offset (from the start of file) and length of an out-of-band buffer
+_entry = Struct('<QQ')
 
-        self._load = load
-        self._dump = dump
+# alignment of out-of-band buffers in file
+_align = 64
 
+# buffers smaller than this (in bytes) are saved in pickle stream
+_inband = 64 * 1024
+
+
+class Pickle(IO):
     def load(self, src: str):
         with open(src, 'rb') as fb:
-            return self._load(fb)
+            if fb.read(len(MAGIC)) != MAGIC:
+                fb.seek(0)
+                return pickle.load(fb)
 
+            # out-of-band buffers are copy-on-write views of the file
+            return loads(mmap(fb.fileno(), 0, access=ACCESS_COPY))
 
     def dump(self, obj: object, dst: str):
-        with open(dst, 'wb') as fb:
-            self._dump(obj, fb)
+        # arrays loaded from dst are views of its memory map, replace the file instead of truncating it
+        dst = path.realpath(dst)
+        tmp = f'{dst}.{getpid()}.{get_ident()}.tmp'
+
+        try:
+            with open(tmp, 'wb') as fb:
+                for part in dumps(obj):
+                    fb.write(part)
+
+            replace(tmp, dst)
+
+        except BaseException:
+            if path.exists(tmp):
+                remove(tmp)
+
+            raise
+
+
+def dumps(obj: Any) -> List[bytes | memoryview]:
+    """Serialize an object with pickle protocol 5, large buffers (e.g. numpy arrays) are saved out-of-band.
+
+    Returns:
+        List[bytes | memoryview]: Parts of the serialized data to be written without joining.
+    """
+    buffers: List[memoryview] = []
+
+    def callback(buf: pickle.PickleBuffer):
+        raw = buf.raw()
+
+        if raw.nbytes < _inband:
+            return True
+
+        buffers.append(raw)
+
+    stream = pickle.dumps(obj, protocol=5, buffer_callback=callback)
+
+    if not buffers:
+        return [stream]
+
+    parts: List[bytes | memoryview] = [b'', stream]
+    table = []
+    offset = _header.size + _entry.size * len(buffers) + len(stream)
+
+    for buf in buffers:
+        pad = -offset % _align
+        offset += pad
+        parts.append(b'\0' * pad)
+        parts.append(buf)
+        table.append(_entry.pack(offset, buf.nbytes))
+        offset += buf.nbytes
+
+    parts[0] = _header.pack(MAGIC, len(stream), len(buffers)) + b''.join(table)
+
+    return parts
+
+
+def loads(data: bytes | memoryview | mmap) -> Any:
+    """Deserialize data from dumps(), out-of-band buffers are views of data without copying."""
+    view = memoryview(data)
+
+    if view[:len(MAGIC)] != MAGIC:
+        return pickle.loads(view)
+
+    _, size, nbuf = _header.unpack_from(view)
+    start = _header.size + _entry.size * nbuf
+    buffers = []
+
+    for i in range(nbuf):
+        offset, length = _entry.unpack_from(view, _header.size + _entry.size * i)
+        buffers.append(view[offset: offset + length])
+
+    return pickle.loads(view[start: start + size], buffers=buffers)
 
 
 define_io(('pickle', 'pkl'), Pickle)
@@ -27,6 +27,9 @@ class Job(ABC):
     # number of gpus per node
     gpus_per_node: int = 0
 
+    # memory per node (in GB) available to mpiexec tasks, 0: not limited
+    mem_per_node: int | float = 0
+
     # time interval to check status updates from other jobs (in minutes)
     status_update: int | float = 0.1
 
@@ -24,6 +24,7 @@ async def _execute(stage: Stage | None, main: bool):
                 stage = s
                 stage.func = stage.func.load() # type: ignore
                 stage.flat = False
+                stage.touch()
                 break
 
         elif s.renew(stage):
@@ -56,12 +57,19 @@ async def _execute(stage: Stage | None, main: bool):
 
         elif current := current_stage():
             current.error = e
+            current.touch()
 
     if stage is not None and not stage.flat:
         from .data.data import save_data
 
         ctx._save(stage)
         save_data()
+        await ctx.flush()
+
+        if config['gc_on_exit']:
+            from .cleanup import gc
+
+            gc([stage, *load_cache()])
     
     return output
 
@@ -1,17 +1,22 @@
 from __future__ import annotations
 import asyncio
-from typing import Callable, Dict, Tuple, List, Literal, Collection, cast
-from math import ceil
+from typing import Callable, Dict, Tuple, List, Set, Literal, Collection, cast
+from math import ceil, floor, log10, inf
 from time import time
 from datetime import timedelta
 from fractions import Fraction
+from heapq import heappush, heappop
+from itertools import count
 from inspect import signature
 from sys import stderr
 
-from .directory import ws
+from .directory import ws, to_io_thread
 from .config import config
 from .wrapper import stage
 from .data.function import Function
+from .stage import current_stage
+from .cleanup import PATH_TASKS
+from . import history
 from .jobs.job import Job, _job_cls
 
 
@@ -61,94 +66,389 @@ class MPIOutput:
         return self._stderr
 
 
+# resource of a process or a node: [cpus, gpus, memory (in GB)]
+Resource = List[Fraction | int | float]
+
+# resource request of a task: (number of processes, resource of each process, whether nodes are used exclusively)
+Demand = Tuple[int, Tuple[Fraction | int, ...], bool]
+
 # pending task, asyncio.Lock -> (nnodes, priority) (Fraction for MPI tasks, int for multiprocessing tasks)
 _pending: Dict[asyncio.Lock, Tuple[Fraction | int, int]] = {}
 
-# running tasks, asyncio.Lock -> nnodes
-_running: Dict[asyncio.Lock, Fraction | int] = {}
+# running tasks, asyncio.Lock -> (whether executed with multiprocessing, [(node index, resource taken from the node)])
+_running: Dict[asyncio.Lock, Tuple[bool, List[Tuple[int, Resource]]]] = {}
+
+# pending tasks grouped by (whether executed with multiprocessing, nnodes, demand, estimated duration),
+# each a heap of (-priority, order, lock)
+# tasks removed from _pending are dropped from the heaps when they reach the top
+_queues: Dict[Tuple[bool, Fraction | int, Demand, float], List[Tuple[int, int, asyncio.Lock]]] = {}
+
+# expected end time of running tasks with estimated duration
+_ends: Dict[asyncio.Lock, float] = {}
+
+# free resource of each node, True: multiprocessing (local node), False: MPI (created from _job on first use)
+_nodes: Dict[bool, List[Resource]] = {}
+
+# maximum free resource of any node and number of unused nodes of each pool in _nodes
+_capacity: Dict[bool, Tuple[Resource, int]] = {}
+
+# highest ranked task that could not be executed in each pool in the last call of _schedule()
+_blocked: Dict[bool, Tuple[tuple, Demand]] = {}
+
+# submission order of tasks with the same priority and nnodes
+_order = count()
 
 # object for cluster configuration
 _job: Job = cast(Job, None)
 
-# loop that checks pending and running tasks every second
+# loop that checks external jobs every second while tasks are pending
 _task: asyncio.Task | None = None
 
 # workers from other jobs or processes that can execute tasks
 _workers: Dict[str, List[asyncio.Lock]] = {}
 
+# file names chosen by running tasks whose log files may not be written yet
+_fnames: Set[str] = set()
 
-def _dispatch(lock: asyncio.Lock, nnodes: Fraction | int) -> bool:
-    """Execute a task if resource is available."""
-    # use multiprocessing if nnodes is int
-    mp = isinstance(nnodes, int)
 
-    if mp:
-        # task is executed with multiprocessing
-        ntotal = _job.cpus_per_node
+def _schedule(added: Tuple[bool, Fraction | int, Demand, float] | None = None):
+    """Execute pending tasks whose resources are available, called when a task is added or finished.
+        Tasks with higher priority and then more nodes are executed first (first-fit decreasing),
+        smaller tasks fill the remaining resources.
+        With config['mpiexec_scheduler'] == 'backfill', a smaller task only runs before a higher ranked task that is waiting
+        if it does not delay the estimated start of that task.
 
-    else:
-        # task is executed with MPI
-        ntotal = _job.nnodes
+    Args:
+        added (tuple | None): Group of a task that was just added. Free resource has not changed since the last call,
+            so only this group is evaluated unless a task is dispatched or blocked with backfill.
+    """
+    backfill = config['mpiexec_scheduler'] == 'backfill'
+
+    # groups whose head cannot be executed, free resource only decreases until this function returns
+    failed = set()
+
+    # highest ranked head that cannot be executed in each pool (from the last full scan if only a new group is evaluated)
+    blocked: Dict[bool, Tuple[tuple, Demand]] = dict(_blocked) if added else {}
+
+    while len(_pending) > 0:
+        # heads of groups that can be executed now and their placement on nodes
+        candidates = []
+
+        # whether other groups need to be evaluated after evaluating only the new group
+        rescan = False
+
+        # the number of groups is the number of distinct task sizes and durations
+        for key in [added] if added else list(_queues):
+            if key in failed or key not in _queues:
+                continue
+
+            queue = _queues[key]
+
+            while queue and queue[0][2] not in _pending:
+                heappop(queue)
+
+            if not queue:
+                del _queues[key]
+                continue
+
+            mp, nnodes, demand, _ = key
+            rank = (queue[0][0], -nnodes, queue[0][1])
+            alloc = _place(mp, demand, _pool(mp)) if _fits(mp, demand) else None
+
+            if alloc is not None:
+                candidates.append((rank, key, alloc))
+                continue
+
+            failed.add(key)
+
+            if backfill and (mp not in blocked or rank < blocked[mp][0]):
+                blocked[mp] = rank, demand
+
+                # tasks held back for the previously blocked task are evaluated again
+                rescan = added is not None
+
+        if rescan:
+            added = None
+            continue
+
+        # reservation of blocked tasks, pool -> (estimated start time, free resource at start time), computed when needed
+        reserved: Dict[bool, Tuple[float, List[Resource]]] = {}
+        best = None
+
+        for rank, key, alloc in sorted(candidates, key=lambda c: c[0]):
+            mp, _, _, duration = key
+
+            if mp not in blocked or rank < blocked[mp][0]:
+                best = key, alloc
+                break
+
+            if mp not in reserved:
+                reserved[mp] = _reserve(mp, blocked[mp][1])
+
+            start, free = reserved[mp]
+
+            if time() + duration <= start < inf:
+                best = key, alloc
+                break
+
+            # the task does not use the resource needed by the blocked task at start time
+            for i, taken in alloc:
+                free[i] = [f - t for f, t in zip(free[i], taken)]
 
-    nrunning = sum(v for v in _running.values() if isinstance(v, int) == mp)
+            if _place(mp, blocked[mp][1], free) is not None:
+                best = key, alloc
+                break
 
-    if nrunning == 0 or nnodes <= ntotal - nrunning:
-        _running[lock] = nnodes
+            for i, taken in alloc:
+                free[i] = [f + t for f, t in zip(free[i], taken)]
+
+        if best is None:
+            break
+
+        key, alloc = best
+        lock = heappop(_queues[key])[2]
+        del _pending[lock]
+        _take(key[0], alloc)
+        _running[lock] = key[0], alloc
+
+        if key[3] < inf:
+            _ends[lock] = time() + key[3]
+
+        lock.release()
+
+        if backfill:
+            # reservation of blocked tasks changes with running tasks
+            added = None
+
+    _blocked.clear()
+    _blocked.update(blocked)
+
+
+def _pool(mp: bool) -> List[Resource]:
+    """Free resource of the nodes of multiprocessing tasks (local node) or MPI tasks."""
+    if mp not in _nodes:
+        _nodes[mp] = [list(_node(mp)) for _ in range(1 if mp else _job.nnodes)]
+        _update(mp)
+
+    return _nodes[mp]
+
+
+def _update(mp: bool):
+    """Update the maximum free resource of any node and the number of unused nodes in a pool."""
+    free = _nodes[mp]
+    node = _node(mp)
+    _capacity[mp] = [max(res[j] for res in free) for j in range(len(node))], sum(res == node for res in free)
+
+
+def _fits(mp: bool, demand: Demand) -> bool:
+    """Check whether a task may fit in the free resource before trying to place it with _place()."""
+    _, need, exclusive = demand
+    free = _pool(mp)
+    top, unused = _capacity[mp]
+
+    if unused == len(free):
+        # a task that does not fit in the empty pool is assigned all nodes
         return True
 
-    return False
+    if exclusive:
+        return unused > 0
+
+    return all(q <= r for q, r in zip(need, top))
+
+
+def _node(mp: bool) -> Resource:
+    """Total resource of a node."""
+    mem = Fraction(_job.mem_per_node) if _job.mem_per_node else inf
+
+    # multiprocessing tasks only request cpus and memory
+    return [_job.cpus_per_node, inf if mp else _job.gpus_per_node, mem]
+
+
+def _place(mp: bool, demand: Demand, free: List[Resource]) -> List[Tuple[int, Resource]] | None:
+    """Assign the processes of a task to nodes with first fit.
+        A task that does not fit in the empty pool is assigned all nodes.
+
+    Returns:
+        List[Tuple[int, Resource]] | None: Node indices and resource taken from each node, None if resource is not available.
+    """
+    nprocs, need, exclusive = demand
+    node = _node(mp)
+    alloc = []
+
+    # resource taken when a node is used exclusively (unlimited resource is not taken)
+    whole = [0 if r == inf else r for r in node]
+
+    for i, res in enumerate(free):
+        if exclusive:
+            # number of processes in an unused node
+            n = _nprocs(node, need, nprocs) if res == node else 0
+            taken = whole
+
+        else:
+            n = _nprocs(res, need, nprocs)
+            taken = [r * n for r in need]
+
+        if n > 0:
+            alloc.append((i, taken))
+            nprocs -= n
+
+            if nprocs == 0:
+                return alloc
+
+    if all(res == node for res in free):
+        return [(i, whole) for i in range(len(free))]
+
+    return None
+
+
+def _nprocs(res: Resource, need: Tuple[Fraction | int, ...], limit: int) -> int:
+    """Number of processes (at most limit) that fit in the resource of a node."""
+    n = limit
+
+    for r, q in zip(res, need):
+        if q and r != inf:
+            n = min(n, int(r // q))
+
+    return n
+
+
+def _take(mp: bool, alloc: List[Tuple[int, Resource]]):
+    """Mark resource as used by a task."""
+    free = _pool(mp)
+
+    for i, taken in alloc:
+        free[i] = [f - t for f, t in zip(free[i], taken)]
+
+    _update(mp)
+
+
+def _release(mp: bool, alloc: List[Tuple[int, Resource]]):
+    """Mark resource as free after a task finishes."""
+    free = _pool(mp)
+
+    for i, taken in alloc:
+        free[i] = [f + t for f, t in zip(free[i], taken)]
+
+    _update(mp)
+
+
+def _reserve(mp: bool, demand: Demand) -> Tuple[float, List[Resource]]:
+    """Earliest time when a task has enough resource if running tasks end as estimated (inf if unknown),
+        and the free resource at that time.
+    """
+    free = [list(res) for res in _pool(mp)]
+    start = time()
+
+    for end, alloc in sorted(((_ends.get(lock, inf), run[1]) for lock, run in _running.items() if run[0] == mp), key=lambda r: r[0]):
+        if _place(mp, demand, free) is not None:
+            break
+
+        for i, taken in alloc:
+            free[i] = [f + t for f, t in zip(free[i], taken)]
+
+        start = end
+
+    return start, free
+
+
+def _estimate(sig: str, duration: float | None) -> float:
+    """Estimated duration of a task from user input or previous tasks with the same signature (inf if unknown)."""
+    if duration is None:
+        duration = history.estimate(sig)
+
+        if duration is None:
+            return inf
+
+    if duration <= 0:
+        return 0.0
+
+    # round up to two significant digits to limit the number of groups in _queues
+    unit = 10 ** (floor(log10(duration)) - 1)
+
+    return ceil(duration / unit) * unit
+
+
+async def _wait(lock: asyncio.Lock, nnodes: Fraction | int, demand: Demand, priority: int, duration: float):
+    """Wait until a task is dispatched."""
+    global _task
+
+    await lock.acquire()
+
+    key = isinstance(nnodes, int), nnodes, demand, duration
+    _pending[lock] = (nnodes, priority)
+    heappush(_queues.setdefault(key, []), (-priority, next(_order), lock))
+
+    # only the group of the new task can be executed with the current free resource
+    _schedule(key)
+
+    if _task is None and len(_pending) > 0:
+        _task = asyncio.create_task(_loop())
+
+    # released by _schedule()
+    await lock.acquire()
+
+
+def _finish(lock: asyncio.Lock):
+    """Remove a finished (or cancelled) task and dispatch pending tasks with the released resources."""
+    if lock in _pending:
+        del _pending[lock]
+
+    if lock in _running:
+        _release(*_running.pop(lock))
+        _ends.pop(lock, None)
+
+    _schedule()
 
 
 async def _loop():
     global _task
 
-    # run next MPI task
     while len(_pending) > 0:
-        # sort entries by their node number and priority, np is (nnodes, priority)
-        nnodes_max = max(np[0] for np in _pending.values())
-        pendings = sorted(_pending.items(), key=lambda item: item[1][1] * nnodes_max + item[1][0], reverse=True)
-
-        # execute tasks if resource is available
-        for lock, np in pendings:
-            if _dispatch(lock, np[0]):
-                del _pending[lock]
-                lock.release()
-        
         # send task to external jobs if any external job is active
-        for job in ws.ls('jobs'):
-            starttime, duration, nnodes = ws.read(f'jobs/{job}').split(',')
+        for job in await ws.als('jobs'):
+            starttime, duration, nnodes = (await ws.aread(f'jobs/{job}')).split(',')
             if float(starttime) + float(duration) < time():
-                ws.rm(f'jobs/{job}')
+                await ws.arm(f'jobs/{job}')
 
             else:
                 pass
 
         await asyncio.sleep(1)
 
+        # resources of external jobs may have changed
+        _schedule()
+
     _task = None
 
 
-@stage(argmap={'check_output': None})
+@stage(argmap={'check_output': None, 'duration': None})
 async def mpiexec(cmd: str | Callable,
-            nprocs: int = 1, cpus_per_proc: int = 1, gpus_per_proc: int | Tuple[Literal[1], int] = 0, *, cwd: str | None = None,
+            nprocs: int = 1, cpus_per_proc: int = 1, gpus_per_proc: int | Tuple[Literal[1], int] = 0, *, mem_per_proc: float = 0, cwd: str | None = None,
             multiprocessing: bool = False, custom_exec: str | None = None, custom_nnodes: int | Tuple[int, int] | None = None,
             args: Collection | None = None, mpiargs: Collection | None = None, fname: str | None = None,
             check_output: Callable[..., None] | None = None, timeout: Literal['auto'] | float | None = 'auto',
-            priority: int = 0) -> MPIOutput:
+            priority: int = 0, duration: float | None = None) -> MPIOutput:
     """Schedule the execution of MPI task."""
     global _job
-    global _task
 
     if _job is None:
         _job = _job_cls[config['job']['job']](config['job'])
+        _nodes.clear()
 
     # remove unused proceesses
     if mpiargs:
         nprocs = min(len(mpiargs), nprocs)
 
+    # identity and signature of the task for history records
+    name = history.identity(cmd)
+    sig = history.signature(name, nprocs, cpus_per_proc, history.gpus(gpus_per_proc))
+
     # calculate node number
     multiprocessing = _job.no_mpi or multiprocessing
 
+    # memory of each process
+    mem = Fraction(mem_per_proc)
+
     if custom_exec and custom_nnodes:
         if isinstance(custom_nnodes, tuple):
             if multiprocessing:
@@ -164,11 +464,23 @@ async def mpiexec(cmd: str | Callable,
             else:
                 nnodes = Fraction(custom_nnodes)
 
+        if multiprocessing:
+            demand: Demand = (nnodes, (1, 0, 0), False)
+
+        else:
+            # processes are unknown, split the request into processes of at most one node
+            n = int(ceil(nnodes))
+            node = _node(False)
+            demand = (n, (nnodes / n * node[0], nnodes / n * node[1], 0), not _job.share_node)
+
     elif multiprocessing:
         nnodes = nprocs
+        demand = (nprocs, (1, 0, mem), False)
 
     else:
         nnodes = Fraction(nprocs * cpus_per_proc, _job.cpus_per_node)
+        gpu = Fraction(gpus_per_proc[0], gpus_per_proc[1]) if isinstance(gpus_per_proc, tuple) else gpus_per_proc
+        demand = (nprocs, (cpus_per_proc, gpu, mem), not _job.share_node)
 
         if isinstance(gpus_per_proc, tuple):
             # check if GPU is enabled
@@ -189,25 +501,41 @@ async def mpiexec(cmd: str | Callable,
         elif gpus_per_proc > 0:
             nnodes = max(nnodes, Fraction(nprocs * gpus_per_proc, _job.gpus_per_node))
 
+        if mem and _job.mem_per_node:
+            nnodes = max(nnodes, nprocs * mem / Fraction(_job.mem_per_node))
+
         if not _job.share_node:
             nnodes = Fraction(int(ceil(nnodes)))
 
     # error occurred
     err = None
 
+    # file name added to _fnames
+    reserved = None
+
+    # time when the task was submitted, dispatched and started
+    time_submit = time()
+    time_dispatch = time_start = None
+
     # task queue controller
     lock = asyncio.Lock()
 
+    # subprocess executing the task
+    process = None
+
     try:
         # wait for node resources
-        await lock.acquire()
+        await _wait(lock, nnodes, demand, priority, _estimate(sig, duration))
+        time_dispatch = time()
 
-        _pending[lock] = (nnodes, priority)
+        # fail early if previous tasks with the same signature did not finish within the remaining walltime
+        early_fail = config['mpiexec_early_fail']
 
-        if _task is None:
-            _task = asyncio.create_task(_loop())
+        if early_fail is not None and early_fail is not False and timeout == 'auto' and _job.time_limited:
+            expected = history.estimate(sig, early_fail, config['mpiexec_early_fail_samples'])
 
-        await lock.acquire()
+            if expected is not None and expected > _job.remaining * 60:
+                raise InsufficientWalltime('Insufficient walltime.')
 
         # determine file name for log, stdout and stderr
         if fname is None:
@@ -223,13 +551,23 @@ async def mpiexec(cmd: str | Callable,
             else:
                 fname = 'mpiexec_' + fname
 
-        if ws.has(f'{fname}.log'):
-            i = 1
+        i = 0
+
+        while True:
+            candidate = fname if i == 0 else f'{fname}#{i}'
+
+            # checked after awaiting because another task may have chosen the same name in the meantime
+            if not await ws.ahas(f'{candidate}.log') and candidate not in _fnames:
+                break
 
-            while ws.has(f'{fname}#{i}.log'):
-                i += 1
+            i += 1
 
-            fname = f'{fname}#{i}'
+        fname = reserved = candidate
+        _fnames.add(fname)
+
+        if stage := current_stage():
+            # task files are removed by `stagekit gc` if the stage is removed
+            await ws.awrite(f'{fname} {stage.id.hex()}\n', PATH_TASKS, 'a')
 
         if not callable(cmd):
             if args or mpiargs:
@@ -253,12 +591,12 @@ async def mpiexec(cmd: str | Callable,
 
                 mpiargs.append(_args[(nprocs - 1) * chunk:])
 
-            ws.rm(f'{fname}.*')
+            await ws.arm(f'{fname}.*')
 
             if callable(cmd):
                 cmd = Function(cmd) # type: ignore
 
-            ws.dump((cmd, args, mpiargs), f'{fname}.pickle')
+            await ws.adump((cmd, args, mpiargs), f'{fname}.pickle')
 
             cmd = f'python -m "stagekit.subprocess.exec" {ws.path()} {fname}'
             cwd = None
@@ -274,14 +612,15 @@ async def mpiexec(cmd: str | Callable,
             cmd = _job.mpiexec(cmd, nprocs, cpus_per_proc, gpus_per_proc)
 
         # write the command actually used
-        ws.write(f'{cmd}\n', f'{fname}.log')
+        await ws.awrite(f'{cmd}\n', f'{fname}.log')
         time_start = time()
 
         # timeout due to insufficient walltime
         timeout_walltime = False
 
         # create subprocess to execute task
-        with open(ws.path(f'{fname}.stdout'), 'w') as f_o, open(ws.path(f'{fname}.stderr'), 'w') as f_e:
+        with await to_io_thread(open, ws.path(f'{fname}.stdout'), 'w') as f_o, \
+            await to_io_thread(open, ws.path(f'{fname}.stderr'), 'w') as f_e:
             # execute in subprocess
             process = await asyncio.create_subprocess_shell(cmd, cwd=cwd, stdout=f_o, stderr=f_e)
 
@@ -315,29 +654,37 @@ async def mpiexec(cmd: str | Callable,
                 check_output()
 
             elif nargs == 1:
-                check_output(ws.read(f'{fname}.stdout'))
+                check_output(await ws.aread(f'{fname}.stdout'))
 
             else:
-                check_output(ws.read(f'{fname}.stdout'), ws.read(f'{fname}.stderr'))
+                check_output(await ws.aread(f'{fname}.stdout'), await ws.aread(f'{fname}.stderr'))
 
         # write elapsed time
-        ws.write(f'\nelapsed: {timedelta(seconds=int(time()-time_start))}\n', f'{fname}.log', 'a')
+        await ws.awrite(f'\nelapsed: {timedelta(seconds=int(time()-time_start))}\n', f'{fname}.log', 'a')
 
-        if ws.has(f'{fname}.error'):
-            raise RuntimeError(ws.read(f'{fname}.error'))
+        if await ws.ahas(f'{fname}.error'):
+            raise RuntimeError(await ws.aread(f'{fname}.error'))
 
         elif process.returncode:
             raise RuntimeError(f'{cmd}\nexit code: {process.returncode}')
 
+
     except Exception as e:
         err = e
 
-    # clear entry
-    if lock in _pending:
-        del _pending[lock]
+    finally:
+        # clear entry and run next tasks, also when cancelled while waiting or running
+        if process is not None and process.returncode is None:
+            process.kill()
 
-    if lock in _running:
-        del _running[lock]
+        _finish(lock)
+
+        if reserved is not None:
+            _fnames.discard(reserved)
+
+    if time_start is not None:
+        history.record(history.Record(name, nprocs, cpus_per_proc, history.gpus(gpus_per_proc), isinstance(nnodes, int), float(nnodes),
+                                      time_submit, time_dispatch - time_submit, time() - time_start, err is None)) # type: ignore
 
     if err:
         raise err
@@ -0,0 +1,249 @@
+from __future__ import annotations
+from typing import List, Dict, Any, TYPE_CHECKING
+from contextlib import closing
+from functools import partial
+from time import time
+import sqlite3
+import pickle
+
+from .directory import ws
+from .writer import writer
+from .stage import Lazy
+
+if TYPE_CHECKING:
+    from .stage import Stage
+
+
+# file name of the database in workspace
+PATH_DB = 'stagekit.db'
+
+# table of saved stages
+_schema = """
+CREATE TABLE IF NOT EXISTS stage (
+    id TEXT PRIMARY KEY,
+    parent TEXT,
+    fingerprint TEXT,
+    name TEXT,
+    version INTEGER,
+    parent_version INTEGER,
+    done INTEGER,
+    error TEXT,
+    state BLOB,
+    result BLOB,
+    started REAL,
+    elapsed REAL
+);
+CREATE INDEX IF NOT EXISTS stage_parent ON stage (parent, fingerprint);
+"""
+
+# insert or update a stage, started and elapsed are updated when version changes or stage is completed
+_upsert = """
+INSERT INTO stage VALUES (:id, :parent, :fingerprint, :name, :version, :parent_version, :done, :error, :state, :result, :now, NULL)
+ON CONFLICT (id) DO UPDATE SET
+    fingerprint = excluded.fingerprint,
+    name = COALESCE(excluded.name, name),
+    version = excluded.version,
+    parent_version = excluded.parent_version,
+    done = excluded.done,
+    error = excluded.error,
+    state = excluded.state,
+    result = COALESCE(excluded.result, result),
+    started = CASE WHEN excluded.version != version THEN excluded.started ELSE started END,
+    elapsed = CASE WHEN excluded.version != version THEN NULL WHEN excluded.done AND NOT done THEN excluded.started - started ELSE elapsed END
+"""
+
+# remove outdated child stages and their descendants
+_prune = """
+WITH RECURSIVE outdated (id) AS (
+    SELECT id FROM stage WHERE parent = :id AND parent_version != :version
+    UNION ALL SELECT stage.id FROM stage JOIN outdated ON stage.parent = outdated.id
+)
+DELETE FROM stage WHERE id IN outdated
+"""
+
+# connection used by the writer thread
+_conn: sqlite3.Connection | None = None
+
+# connection used to load stages on demand
+_reader: sqlite3.Connection | None = None
+
+
+def connect() -> sqlite3.Connection:
+    """Open the database in workspace."""
+    if not ws.has():
+        ws.mkdir()
+
+    conn = sqlite3.connect(ws.path(PATH_DB))
+    conn.executescript(_schema)
+
+    return conn
+
+
+def update(stage: Stage):
+    """Save the state of a stage (without child stages) in the writer thread."""
+    *state, result = stage._state()
+
+    if isinstance(result, Lazy):
+        # result is not changed since loaded
+        result = result.blob
+
+    else:
+        result = pickle.dumps(result)
+
+    row = {
+        'id': stage.id.hex(),
+        'parent': stage.parent.id.hex() if stage.parent else None,
+        'fingerprint': stage.fingerprint().hex(),
+        'name': None if stage.flat else stage.title(),
+        'version': stage.version,
+        'parent_version': stage.parent_version,
+        'done': stage.done,
+        'error': None if stage.error is None else repr(stage.error),
+        'state': pickle.dumps(tuple(state)),
+        'result': result,
+        'now': time()
+    }
+
+    writer.submit(lambda: _write(row))
+
+
+def _write(row: dict):
+    global _conn
+
+    # saved state must not refer to data that failed to be written
+    writer.check()
+
+    if _conn is None:
+        _conn = connect()
+
+    with _conn:
+        _conn.execute(_upsert, row)
+
+        if row['done']:
+            _conn.execute(_prune, row)
+
+
+def load() -> List[Stage]:
+    """Load saved root stages from database, child stages and results are loaded on first access."""
+    if not ws.has(PATH_DB):
+        return []
+
+    # most recent workflow comes first
+    return _children(None)[::-1]
+
+
+def _query(sql: str, *args) -> list:
+    global _reader
+
+    if _reader is None:
+        _reader = connect()
+
+    return _reader.execute(sql, args).fetchall()
+
+
+def _children(pid: str | None) -> List[Stage]:
+    """Load child stages of a stage."""
+    return [_stage(sid, state) for sid, state in _query('SELECT id, state FROM stage WHERE parent IS ? ORDER BY rowid', pid)]
+
+
+def _stage(sid: str, state: bytes) -> Stage:
+    """Create a saved stage from its row, child stages and result are loaded on first access."""
+    from .stage import Stage, Lazy
+
+    s = Stage.__new__(Stage)
+    s.__setstate__(pickle.loads(state))
+    s.history = Children(s) # type: ignore
+    s.result = Lazy(load=partial(_result, sid))
+
+    return s
+
+
+class Children(Lazy):
+    """Saved child stages of a stage, looked up by fingerprint with the stage_parent index until all of them are loaded."""
+    indexed = True
+
+    # parent stage
+    stage: Stage
+
+    # child stages loaded by self.find() or added by self.append(), indexed by the id column (hex of Stage.id)
+    loaded: Dict[str, Stage]
+
+    def __init__(self, stage: Stage):
+        super().__init__(load=self._load_all)
+        self.stage = stage
+        self.loaded = {}
+
+    def find(self, fingerprint: bytes) -> List[Stage]:
+        """Load the saved child stages with a fingerprint, including added stages that are not written yet."""
+        rows = _query('SELECT id, state FROM stage WHERE parent = ? AND fingerprint = ? ORDER BY rowid',
+                      self.stage.id.hex(), fingerprint.hex())
+        stages = [self._get(sid, state) for sid, state in rows]
+        saved = {sid for sid, _ in rows}
+        stages.extend(s for sid, s in self.loaded.items() if sid not in saved and s.fingerprint() == fingerprint)
+
+        return stages
+
+    def append(self, stage: Stage):
+        """Add a new child stage without loading saved child stages."""
+        self.loaded[stage.id.hex()] = stage
+
+    def _get(self, sid: str, state: bytes) -> Stage:
+        # stages already in memory may have changes that are not written yet
+        if sid not in self.loaded:
+            s = self.loaded[sid] = _stage(sid, state)
+            s.parent = self.stage
+
+        return self.loaded[sid]
+
+    def _load_all(self) -> List[Stage]:
+        rows = _query('SELECT id, state FROM stage WHERE parent = ? ORDER BY rowid', self.stage.id.hex())
+        stages = [self._get(sid, state) for sid, state in rows]
+        saved = {sid for sid, _ in rows}
+        stages.extend(s for sid, s in self.loaded.items() if sid not in saved)
+
+        if self.stage.done:
+            # outdated child stages may not be removed from database yet
+            stages = [s for s in stages if s.parent_version == self.stage.version]
+
+        return stages
+
+
+def _result(sid: str) -> Any:
+    """Load the result of a stage."""
+    return pickle.loads(_query('SELECT result FROM stage WHERE id = ?', sid)[0][0])
+
+
+def log() -> str:
+    """Display the saved workflows without loading stage states."""
+    if not ws.has(PATH_DB):
+        return ''
+
+    # rows of stages indexed by parent
+    children: Dict[str | None, list] = {}
+
+    with closing(connect()) as conn:
+        for row in conn.execute('SELECT id, parent, name, version, parent_version, done, error, elapsed FROM stage ORDER BY rowid'):
+            children.setdefault(row[1], []).append(row)
+
+    def fmt(row, indent: int):
+        sid, _, name, version, _, done, error, elapsed = row
+        msg = name or '<anonymous stage>'
+
+        if error:
+            msg += f' (error: {error})'
+
+        elif not done:
+            msg += ' (not completed)'
+
+        elif elapsed is not None:
+            msg += f' ({elapsed:.2f}s)'
+
+        items = [c for c in children.get(sid, []) if c[4] == version]
+        nidx = 1 + len(str(len(items)))
+
+        for i, c in enumerate(items):
+            msg += '\n' + '  ' * indent + f'{i+1})' + ' ' * (nidx - len(str(i+1))) + fmt(c, indent + 1)
+
+        return msg
+
+    return '\n'.join(fmt(row, 1) for row in reversed(children.get(None, [])))
@@ -1,123 +1,263 @@
 from __future__ import annotations
-from typing import Any, List, Dict, Mapping, Sequence, TYPE_CHECKING
+from typing import Any, List, Dict, Mapping, Sequence, Callable, TYPE_CHECKING
+from functools import partial
+from types import MappingProxyType
+from hashlib import blake2b
+from numbers import Number, Complex
+from sys import modules
+from uuid import uuid4
 import asyncio
+import pickle
 
 from .task import create_child_task
-from .data.data import _data_cls
-from .data.function import Function
+from .data.data import find_data
+from .data.function import Function, intern
 
 if TYPE_CHECKING:
     from .wrapper import StageFunc
     from .context import Context
 
 
+# shared value of empty kwargs and data
+_empty: Mapping[str, Any] = MappingProxyType({})
+
+# shared value of empty history, replaced by a list when a child stage is added
+_nohistory: List[Stage] = () # type: ignore
+
+# value of Stage._flat when flattened arguments are the same objects as Stage.args and Stage.kwargs
+_unchanged: tuple[tuple, Mapping[str, Any]] = ((), _empty)
+
+
 class Stage:
     """Wrapper of a function to save execution progress.
         Note: Stage is intended to be a purely internal class,
         do not create a stage directly with Stage(), use decorator @stage instead."""
+    __slots__ = ('id', 'data', 'func', 'args', 'kwargs', 'cwd', '_history', 'parent', '_result',
+                 'done', 'error', 'version', 'parent_version', 'flat', '_flat', '_fingerprint', '_index', '_blob')
+
+    # unique identifier of the stage in saved state (16 bytes)
+    id: bytes
+
     # data defined by stage function accessed through ctx
-    data: dict
+    data: Mapping[str, Any]
 
     # stage function
     func: StageFunc
 
     # arguments of self.func
-    args: List[Any]
+    args: Sequence[Any]
 
     # keyword arguments of self.func
-    kwargs: Dict[str, Any]
+    kwargs: Mapping[str, Any]
 
     # working directory relative to parent stage
     cwd: str | None
 
-    # executed child stages
-    history: List[Stage]
+    # executed child stages (or loader of saved child stages)
+    _history: List[Stage] | Lazy
 
     # parent stage
-    parent: Stage | None = None
+    parent: Stage | None
 
-    # return value of self.func
-    result: Any = None
+    # return value of self.func (or loader of saved return value)
+    _result: Any
 
     # main function successfully executed
-    done = False
+    done: bool
 
     # error occured during execution
-    error: Exception | None = None
+    error: Exception | None
 
     # number of times executed
-    version: int = 0
+    version: int
 
     # number of times parent stage is executed
     parent_version: int
 
     # args and kwargs are restored from a saved state
     # a flat stage cannot be re-run unless the arguments are updated by self.renew()
-    flat = False
+    flat: bool
+
+    # flattened args and kwargs computed once by self.flatargs(), _unchanged if they are self.args and self.kwargs (not saved)
+    _flat: tuple[tuple, Mapping[str, Any]] | None
+
+    # 16-byte digest of function, cwd and flattened arguments used to look up matching stages
+    _fingerprint: bytes | None
+
+    # child stages in self.history indexed by fingerprint (not saved)
+    _index: Dict[bytes, List[Stage]] | None
+
+    # serialized state and child stages of a completed stage, None if changed since last serialization
+    # or if already included in the serialized state of a completed parent stage (not saved)
+    _blob: bytes | None
 
     def __init__(self, func: StageFunc, args: Sequence, kwargs: Mapping[str, Any], cwd: str | None, parent_version: int):
+        self.id = uuid4().bytes
         self.func = func
-        self.args = list(args)
-        self.kwargs = dict(kwargs)
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs) if kwargs else _empty
         self.cwd = cwd
         self.parent_version = parent_version
 
-        self.history = []
-        self.data = {}
-    
-    def __getstate__(self):
-        if self.flat:
-            return self.__dict__
+        self.data = _empty
+        self._history = _nohistory
+        self.parent = None
+        self._result = None
+        self.done = False
+        self.error = None
+        self.version = 0
+        self.flat = False
+        self._flat = None
+        self._fingerprint = None
+        self._index = None
+        self._blob = None
 
-        state = self.__dict__.copy()
-    
-        state['flat'] = True
-        state['func'] = self.flatfunc()
-        
-        args = state['args'] = []
-        kwargs = state['kwargs'] = {}
+    @property
+    def history(self) -> List[Stage]:
+        """Executed child stages."""
+        if isinstance(self._history, Lazy):
+            self._history = _load_history(self._history.load(), self)
 
-        co_varnames = self.func.func.__code__.co_varnames
+            # index may only contain the stages looked up in a lazy history
+            self._index = None
 
-        for i, a in enumerate(self.args):
-            args.append(self.flatarg(co_varnames[i], a))
-        
-        for k, a in self.kwargs.items():
-            kwargs[k] = self.flatarg(k, a)
+            for s in self._history:
+                s.parent = self
+
+        return self._history
+
+    @history.setter
+    def history(self, history: List[Stage]):
+        self._history = history
+
+    @property
+    def result(self) -> Any:
+        """Return value of self.func."""
+        if isinstance(self._result, Lazy):
+            self._result = self._result.load()
+
+        return self._result
+
+    @result.setter
+    def result(self, result: Any):
+        self._result = result
 
-        return state
+    def __getstate__(self):
+        # result is loaded only when accessed
+        result = self._result if isinstance(self._result, Lazy) else Lazy(pickle.dumps(self._result))
+
+        return self._state()[:-1] + (result, self._dump())
+
+    def __setstate__(self, state: tuple | dict):
+        """Restore saved state, child stages and result are loaded on first access."""
+        if isinstance(state, dict):
+            # saved by an older version
+            state = (state.get('id') or uuid4().bytes, state['func'], state['args'], state['kwargs'], state['cwd'], state.get('data'),
+                     state.get('done', False), state.get('error'), state.get('version', 0), state['parent_version'],
+                     state.get('_fingerprint'), state.get('result'), state.get('history'))
+
+        self.parent = None
+        self._result = None
+        self._flat = None
+        self._index = None
+        self._blob = None
+        self._history = _nohistory
+        self._restore(state)
+
+        if len(state) > 12 and state[12]:
+            if isinstance(state[12], bytes):
+                self._history = Lazy(state[12])
+
+            else:
+                # saved by an older version
+                self._history = Lazy(load=partial(_identity, state[12]))
+
+    def _restore(self, state: tuple):
+        """Update saved properties from the return value of self._state()."""
+        self.id, self.func, self.args, kwargs, self.cwd, data, self.done, self.error, \
+            self.version, self.parent_version, self._fingerprint = state[:11]
+
+        self.kwargs = kwargs or _empty
+        self.data = data or _empty
+
+        # saved by an older version as hex strings
+        if isinstance(self.id, str):
+            self.id = bytes.fromhex(self.id)
+
+        if isinstance(self._fingerprint, str):
+            self._fingerprint = bytes.fromhex(self._fingerprint)
+        self.flat = True
+        self._flat = None
+
+        if len(state) > 11:
+            self._result = state[11]
+
+    def _state(self) -> tuple:
+        """Get saved state excluding child stages."""
+        args, kwargs = self.flatargs()
+
+        return (self.id, self.flatfunc(), args, dict(kwargs) or None, self.cwd, dict(self.data) or None, self.done, self.error,
+                self.version, self.parent_version, self.fingerprint(), self._result)
+
+    def _record(self) -> bytes:
+        """Serialize self and child stages, reusing the result of last call if self is completed and unchanged."""
+        if self._blob is not None:
+            return self._blob
+
+        # function and result are saved without their classes, which are not shared between records
+        func = self.flatfunc()
+        result = self._result.blob if isinstance(self._result, Lazy) and self._result.blob is not None else pickle.dumps(self.result)
+        state = self._state()
+        record = pickle.dumps((state[0], (func.module, func.name, func.path), *state[2:11], result, self._dump()))
+
+        if self.done:
+            self._blob = record
+
+            # child stages are included in the record, only the outermost completed stage keeps it
+            if not isinstance(self._history, Lazy):
+                for s in self._history:
+                    s._blob = None
+
+        return record
+
+    def _dump(self) -> bytes | None:
+        """Serialize child stages by joining their records, only changed child stages are serialized again."""
+        if isinstance(self._history, Lazy) and self._history.blob is not None:
+            # not loaded since restored
+            return self._history.blob
+
+        if not self.history:
+            return None
+
+        return pickle.dumps([s._record() for s in self.history])
 
     def __eq__(self, other):
-        if not isinstance(other, Stage) or self.flatfunc() != other.flatfunc() or self.cwd != other.cwd:
+        if not isinstance(other, Stage) or self.fingerprint() != other.fingerprint():
             return False
-        
-        if self.flat and other.flat:
-            return self.args == other.args and self.kwargs == other.kwargs
 
-        if len(self.args) != len(other.args) or len(self.kwargs) != len(other.kwargs):
+        if self.flatfunc() != other.flatfunc() or self.cwd != other.cwd:
             return False
 
-        # get variable names from the non-flat Stage object
-        co_varnames = (other if self.flat else self).func.func.__code__.co_varnames
+        return self.flatargs() == other.flatargs()
 
-        for i, (arg1, arg2) in enumerate(zip(self.args, other.args)):
-            k = co_varnames[i]
+    def __repr__(self):
+        msg = self.title() + '\n'
 
-            if self.flatarg(k, arg1) != other.flatarg(k, arg2):
-                return False
+        children = []
+
+        for s in self.history:
+            if s.parent_version == self.version:
+                children.append(s)
         
-        for k in self.kwargs:
-            if k not in other.kwargs:
-                return False
-            
-            if self.flatarg(k, self.kwargs[k]) != other.flatarg(k, other.kwargs[k]):
-                return False
+        nidx = 1 + len(str(len(children)))
 
-        return True
+        for i, s in enumerate(children):
+            msg += f'{i+1})' + ' ' * (nidx - len(str(i+1))) + repr(s).replace('\n', '\n  ')
+        
+        return msg
     
-    def __repr__(self):
-        msg = ''
-
+    def title(self) -> str:
+        """Display name in command `stagekit log`."""
         func = self.func.load() if self.flat else self.func # type: ignore
 
         if func.name:
@@ -128,35 +268,75 @@ class Stage:
             for i in range(len(self.args)):
                 d[co_varnames[i]] = self.args[i]
             
-            msg += func.name(d)
+            return func.name(d)
+
+        if hasattr(func.func, '__name__'):
+            return func.func.__name__
+
+        return '<anonymous stage>'
+
+    def append(self, stage: Stage):
+        """Add a child stage to self.history."""
+        if isinstance(self._history, Lazy) and self._history.indexed:
+            self._history.append(stage) # type: ignore
 
-        elif hasattr(func.func, '__name__'):
-            msg += func.func.__name__
-        
         else:
-            msg += '<anonymous stage>'
+            if self.history is _nohistory:
+                self.history = []
 
-        msg += '\n'
+            self.history.append(stage)
 
-        children = []
+        self.touch()
 
-        for s in self.history:
-            if s.parent_version == self.version:
-                children.append(s)
-        
-        nidx = 1 + len(str(len(children)))
+    def touch(self):
+        """Mark self and parent stages as changed since last serialization."""
+        stage = self
+
+        # a parent may keep a blob while stages between it and self do not
+        while stage is not None:
+            stage._blob = None
+            stage = stage.parent
+
+    def fingerprint(self) -> bytes:
+        """Digest of function, cwd and flattened arguments (stages that are equal always have the same fingerprint)."""
+        if self._fingerprint is None:
+            func = self.flatfunc()
+            args, kwargs = self.flatargs()
+            key = (func.module, func.name, func.path, self.cwd, [_fingerprint_arg(a) for a in args],
+                   sorted((k, _fingerprint_arg(a)) for k, a in kwargs.items()))
+            self._fingerprint = blake2b(repr(key).encode(), digest_size=16).digest()
+
+        return self._fingerprint
 
-        for i, s in enumerate(children):
-            msg += f'{i+1})' + ' ' * (nidx - len(str(i+1))) + repr(s).replace('\n', '\n  ')
-        
-        return msg
-    
     def flatfunc(self):
         """Get Function object corresponding to self.func for comparison and serialization."""
         if self.flat:
             return self.func
 
-        return Function(self.func.func)
+        return self.func.function
+
+    def flatargs(self) -> tuple[tuple, Mapping[str, Any]]:
+        """Get flattened args and kwargs for comparison and serialization, computed once until self.renew() updates the arguments."""
+        if self.flat:
+            # saved by an older version as a list
+            return tuple(self.args), self.kwargs
+
+        if self._flat is None:
+            co_varnames = self.func.func.__code__.co_varnames
+            args = tuple(self.flatarg(co_varnames[i], a) for i, a in enumerate(self.args))
+            kwargs = {k: self.flatarg(k, a) for k, a in self.kwargs.items()}
+
+            if all(a is b for a, b in zip(args, self.args)) and all(kwargs[k] is a for k, a in self.kwargs.items()):
+                # most arguments are not wrapped, so the original tuple is kept instead of a copy
+                self._flat = _unchanged
+
+            else:
+                self._flat = (args, MappingProxyType(kwargs) if kwargs else _empty)
+
+        if self._flat is _unchanged:
+            return self.args, self.kwargs
+
+        return self._flat
 
     def flatarg(self, k: str, val: Any):
         """Flatten an argument of stage function based on argmap parameter or data wrapper.
@@ -175,11 +355,9 @@ class Stage:
 
             return argmap[k](val) # type: ignore
 
-        for test, data in _data_cls.items():
-            if test(val):
-                return data(val)
-        
-        return val
+        data = find_data(val)
+
+        return val if data is None else data(val)
 
     def renew(self, other: Stage):
         """Compare self (previously saved stage) with a new stage and update args if needs to re-run."""
@@ -197,6 +375,10 @@ class Stage:
                 self.kwargs = other.kwargs
                 self.done = False
                 self.flat = False
+
+                # other is equal to self, so its flattened arguments are reused
+                self._flat = other._flat
+                self.touch()
             
             return True
         
@@ -210,7 +392,9 @@ class Stage:
         # initialize state
         self.done = False
         self.version += 1
-        self.data = {}
+        self.data = _empty
+        self.touch()
+        ctx._update(self)
 
         chdir = ctx._chdir
         ctx._chdir = None
@@ -223,11 +407,16 @@ class Stage:
 
         self.result = result
 
-        # remove outdated child stages
-        self.history = list(filter(lambda s: s.parent_version == self.version, self.history))
+        # remove outdated child stages (an indexed lazy history removes them when loaded)
+        if not isinstance(self._history, Lazy) or not self._history.indexed:
+            self.history = [s for s in self.history if s.parent_version == self.version] or _nohistory
+
+        self._index = None
 
         # save execution state
         self.done = True
+        self.touch()
+        ctx._update(self)
         asyncio.create_task(ctx.checkpoint())
 
         ctx._chdir = chdir
@@ -245,20 +434,164 @@ class Stage:
         Returns:
             Any: Return value of stage function.
         """
-        for s in self.history:
+        fingerprint = stage.fingerprint()
+        indexed = isinstance(self._history, Lazy) and self._history.indexed
+
+        if self._index is None:
+            # built before assigned, because loading a lazy history resets self._index
+            index: Dict[bytes, List[Stage]] = {}
+
+            if not indexed:
+                for s in self.history:
+                    index.setdefault(s.fingerprint(), []).append(s)
+
+            self._index = index
+
+        if indexed and fingerprint not in self._index:
+            # saved child stages are looked up without loading the others
+            self._index[fingerprint] = self._history.find(fingerprint) # type: ignore
+
+        candidates = self._index.setdefault(fingerprint, [])
+
+        for s in candidates:
             if s.renew(stage):
                 if not s.done:
                     await create_child_task(s.execute(ctx), s)
                 
-                s.parent_version = stage.parent_version
+                if s.parent_version != stage.parent_version:
+                    s.parent_version = stage.parent_version
+                    s.touch()
+                    ctx._update(s)
+
                 return s.result
 
-        self.history.append(stage)
+        self.append(stage)
+        candidates.append(stage)
         await create_child_task(stage.execute(ctx), stage)
 
         return stage.result
 
 
+class Lazy:
+    """Saved value that is loaded on first access."""
+    # saved child stages can be looked up with self.find(fingerprint) and added with self.append(stage)
+    # without loading all of them (see sqlite.Children)
+    indexed = False
+
+    # serialized value
+    blob: bytes | None
+
+    # function to load the value if blob is None
+    _load: Callable[[], Any] | None
+
+    def __init__(self, blob: bytes | None = None, load: Callable[[], Any] | None = None):
+        self.blob = blob
+        self._load = load
+
+    def __reduce__(self):
+        if self.blob is None:
+            return (_identity, (self.load(),))
+
+        return (Lazy, (self.blob,))
+
+    def load(self) -> Any:
+        """Load saved value."""
+        if self.blob is None:
+            return self._load() # type: ignore
+
+        return pickle.loads(self.blob)
+
+
+def _identity(val: Any) -> Any:
+    return val
+
+
+def _load_history(items: List[bytes | Stage], parent: Stage) -> List[Stage]:
+    """Load child stages from the records saved by Stage._dump() (or stages saved by an older version)."""
+    history = []
+
+    for item in items:
+        if isinstance(item, bytes):
+            state = pickle.loads(item)
+
+            if isinstance(state, Stage):
+                # separately serialized by an older version
+                stage = state
+
+            else:
+                stage = Stage.__new__(Stage)
+                stage.__setstate__((state[0], intern(*state[1]), *state[2:11], Lazy(state[11]), state[12]))
+
+                if stage.done and not parent.done:
+                    # record is reused until the stage is changed
+                    stage._blob = item
+
+            item = stage
+
+        history.append(item)
+
+    return history
+
+
+def _fingerprint_arg(val: Any) -> Any:
+    """Convert a flattened argument to a key for Stage.fingerprint().
+        Values that compare equal must produce the same key, unequal values may collide."""
+    # numpy scalars compare equal to python scalars (numpy is not imported unless already used)
+    np = modules.get('numpy')
+
+    if np is not None and isinstance(val, np.generic):
+        val = val.item()
+
+    if val is None:
+        return val
+
+    # subclasses such as numpy.str_ have a different repr
+    if isinstance(val, str):
+        return str.__str__(val)
+
+    if isinstance(val, bytes):
+        return bytes(val)
+
+    if isinstance(val, Number):
+        # 1 == 1.0 == True == 1+0j
+        try:
+            if isinstance(val, Complex):
+                if val.imag:
+                    return complex(val)
+
+                val = val.real
+
+            if val == int(val): # type: ignore
+                return int(val) # type: ignore
+
+            return float(val) # type: ignore
+
+        except (OverflowError, ValueError, TypeError):
+            return val
+
+    if isinstance(val, (list, tuple)):
+        return [_fingerprint_arg(v) for v in val]
+
+    if isinstance(val, dict):
+        return sorted(((repr(_fingerprint_arg(k)), _fingerprint_arg(v)) for k, v in val.items()), key=lambda kv: kv[0])
+
+    if isinstance(val, Function):
+        return (val.module, val.name, val.path)
+
+    # imported here to keep the registration order of data wrappers
+    from .data.object import Object
+    from .data.numpy import Numpy
+
+    if isinstance(val, Object):
+        return (val.func.module, val.func.name, _fingerprint_arg(val.state))
+
+    if isinstance(val, Numpy):
+        return (val.dtype, val.shape, val.digest)
+
+    # objects with custom __eq__ are only distinguished by type
+    return type(val).__qualname__
+
+
 def current_stage() -> Stage | None:
     """Get current running stage."""
     try:
@@ -4,7 +4,6 @@ from os.path import dirname, join
 from sys import argv, stderr, stdout
 from traceback import format_exc
 from functools import partial
-import pickle
 
 
 def _call(size: int, idx: int):
@@ -27,11 +26,12 @@ def _call(size: int, idx: int):
         stat.size = size
 
     # saved function and arguments from main process
-    with open(f'{join(argv[1], argv[2])}.pickle', 'rb') as f:
-        func, args, mpiargs = pickle.load(f)
+    from stagekit.io.pickle import Pickle
 
-        if hasattr(func, 'load'):
-            func = func.load()
+    func, args, mpiargs = Pickle().load(f'{join(argv[1], argv[2])}.pickle')
+
+    if hasattr(func, 'load'):
+        func = func.load()
 
     # call target function
     if callable(func):
@@ -4,6 +4,7 @@ from typing import ParamSpec, Awaitable, Dict, Callable, Any, Literal, cast, ove
 from .stage import Stage, current_stage
 from .context import Context
 from .config import config
+from .data.function import Function, intern
 
 
 # current running context
@@ -30,6 +31,9 @@ class StageFunc:
     # display name in command `stagekit log`
     name: Callable[[dict], str] | None
 
+    # interned Function object of self.func for comparison and serialization
+    _function: Function | None = None
+
     def __init__(self, func: Callable, rerun: bool | Literal['auto'],
                  argmap: ArgMap | None, name: Callable[[dict], str] | None):
         self.func = func
@@ -40,6 +44,15 @@ class StageFunc:
         if argmap:
             self.argmap.update(argmap)
     
+    @property
+    def function(self) -> Function:
+        """Function object of self.func shared by all stages created from self."""
+        if self._function is None:
+            func = Function(self.func)
+            self._function = intern(func.module, func.name, func.path)
+
+        return self._function
+
     def __call__(self, *args, **kwargs):
         current = current_stage()
 
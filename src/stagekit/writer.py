@@ -0,0 +1,99 @@
+from __future__ import annotations
+from typing import Callable, Deque, Tuple
+from collections import deque
+from threading import Thread, Condition
+from traceback import format_exc
+from sys import stderr
+
+
+class WriteError(IOError):
+    """A previous write operation failed, so saved state may refer to data that was never written."""
+
+
+class Writer:
+    """Thread that writes checkpoints in submission order without blocking the event loop."""
+    # pending write operations and whether they are kept when replaced
+    _queue: Deque[Tuple[Callable[[], None], bool]]
+
+    # notified when the queue or the busy state changes
+    _cond: Condition
+
+    # a write operation is in progress
+    _busy = False
+
+    # writer thread (started on first submission)
+    _thread: Thread | None = None
+
+    # first exception raised by a write operation
+    error: Exception | None = None
+
+    def __init__(self):
+        self._queue = deque()
+        self._cond = Condition()
+
+    def submit(self, func: Callable[[], None], replace: bool = False, keep: bool = False):
+        """Add a write operation to the queue.
+
+        Args:
+            func (Callable[[], None]): Function that performs the write.
+            replace (bool, optional): Drop pending operations because func supersedes them (e.g. a full snapshot). Defaults to False.
+            keep (bool, optional): Never drop func when a later operation is submitted with replace (e.g. saving data referenced by snapshots). Defaults to False.
+        """
+        with self._cond:
+            if replace:
+                self._queue = deque(item for item in self._queue if item[1])
+
+            self._queue.append((func, keep))
+
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='stagekit-writer', daemon=True)
+                self._thread.start()
+
+            self._cond.notify_all()
+
+    def flush(self):
+        """Block until all submitted operations are written.
+
+        Raises:
+            WriteError: A write operation failed.
+        """
+        with self._cond:
+            while self._queue or self._busy:
+                self._cond.wait()
+
+        self.check()
+
+    def check(self):
+        """Raise WriteError if a write operation failed, called before writing state that refers to earlier writes."""
+        if self.error is not None:
+            raise WriteError(f'a previous write operation failed: {self.error!r}') from self.error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+
+                func = self._queue.popleft()[0]
+                self._busy = True
+
+            try:
+                func()
+
+            except WriteError:
+                # already reported
+                pass
+
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+                print(format_exc(), file=stderr)
+
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+
+# writer of stagekit.pickle, stagekit.journal and data files
+writer = Writer()
@@ -0,0 +1,55 @@
+"""Time spent on the event loop per checkpoint while a parameter sweep is running.
+    Usage: python tests/bench_checkpoint.py [number_of_stages] [number_of_checkpoints]
+    Also runs on the original repository (set PYTHONPATH to its src directory) to compare.
+"""
+from sys import argv
+from time import perf_counter
+import pickle
+
+from stagekit import stage
+from stagekit.stage import Stage
+
+
+@stage
+async def forward(event: int, name: str):
+    pass
+
+
+@stage
+async def sweep():
+    pass
+
+
+def add(parent: Stage, i: int):
+    s = Stage(forward, [i, f'event_{i:06d}'], {}, None, 1)
+    s.parent = parent
+    s.version = 1
+    s.done = True
+    s.result = i
+
+    if hasattr(parent, 'append'):
+        parent.append(s)
+
+    else:
+        parent.history.append(s)
+
+
+def measure(n: int, m: int):
+    root = Stage(sweep, [], {}, None, 0)
+    root.version = 1
+    root.history = []
+
+    for i in range(n):
+        add(root, i)
+
+    for k in range(m):
+        # same serialization as cache.save_cache(), the rest is done by the writer thread
+        start = perf_counter()
+        blob = pickle.dumps([root])
+        print(f'checkpoint {k}: {perf_counter() - start:.3f}s ({len(blob) / 1e6:.1f} MB)')
+
+        add(root, n + k)
+
+
+if __name__ == '__main__':
+    measure(int(argv[1]) if len(argv) > 1 else 50000, int(argv[2]) if len(argv) > 2 else 5)
@@ -0,0 +1,83 @@
+"""Size and throughput of compression codecs for checkpoints and data chunks.
+    Usage: python tests/bench_compression.py [number_of_stages]
+"""
+from sys import argv
+from io import BytesIO
+from time import perf_counter
+import pickle
+
+import numpy as np
+
+from stagekit import stage, checksum
+from stagekit.stage import Stage
+
+
+@stage
+async def forward(event: int, name: str, model: str):
+    pass
+
+
+@stage
+async def inversion():
+    pass
+
+
+# codecs and levels to compare (None: uncompressed)
+codecs = [(None, None), ('zlib', 1), ('zlib', 6), ('zlib', 9), ('bz2', 9), ('lzma', 0), ('lzma', 6)]
+
+
+def build(n: int) -> bytes:
+    """Checkpoint of a workflow with 10 iterations of n / 10 forward stages."""
+    root = Stage(inversion, [], {}, None, 0)
+    root.version = 1
+
+    for it in range(10):
+        s = Stage(inversion, [], {}, f'iter_{it:02d}', 1)
+        s.version = 1
+
+        for i in range(n // 10):
+            c = Stage(forward, [i, f'event_{i:06d}', f'model_{it:02d}'], {}, f'event_{i:06d}', 1)
+            c.version = 1
+            c.done = True
+            c.result = {'misfit': float(i) / (it + 1), 'station': f'ST{i % 97:03d}'}
+            s.append(c)
+
+        s.done = True
+        root.append(s)
+
+    return pickle.dumps([root])
+
+
+def arrays() -> bytes:
+    """Data chunk of smooth float fields and integer indices."""
+    x = np.linspace(0, 10, 1000000)
+    items = [np.sin(x * (k + 1)) * np.exp(-x / 5) for k in range(4)]
+    items.append(np.round(np.cumsum(np.ones(1000000)) / 7).astype(np.int64))
+
+    return b''.join(pickle.dumps(a) for a in items)
+
+
+def measure(name: str, data: bytes):
+    print(f'{name}: {len(data) / 1024 ** 2:.1f}MB')
+    print(f'  {"codec":<10}{"ratio":>8}{"write MB/s":>12}{"read MB/s":>12}')
+
+    for codec, level in codecs:
+        fb = BytesIO()
+
+        start = perf_counter()
+        checksum.dump(data, fb, None, codec, level)
+        write = perf_counter() - start
+
+        fb.seek(0)
+        start = perf_counter()
+        assert checksum.load(fb) == data
+        read = perf_counter() - start
+
+        label = 'none' if codec is None else f'{codec}:{level}'
+        mb = len(data) / 1024 ** 2
+        print(f'  {label:<10}{len(data) / len(fb.getvalue()):>8.2f}{mb / write:>12.0f}{mb / read:>12.0f}')
+
+
+if __name__ == '__main__':
+    measure('checkpoint', build(int(argv[1]) if len(argv) > 1 else 20000))
+    measure('data chunk', arrays())
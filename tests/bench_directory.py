@@ -0,0 +1,39 @@
+"""Operations per second of Directory file operations in a deep workspace.
+    Usage: python tests/bench_directory.py [number_of_operations]
+"""
+from sys import argv
+from time import perf_counter
+from tempfile import mkdtemp
+from shutil import rmtree
+
+from stagekit.directory import Directory
+
+
+def measure(n: int):
+    d = Directory()
+    d._cwd = mkdtemp()
+
+    # deep workspace
+    deep = '/'.join(f'level_{i}' for i in range(8))
+    d.mkdir(deep)
+
+    def bench(name: str, op):
+        start = perf_counter()
+
+        for i in range(n):
+            op(i)
+
+        print(f'{name:<8}{n / (perf_counter() - start):>10.0f} ops/s')
+
+    bench('mkdir', lambda i: d.mkdir(f'{deep}/dir_{i}'))
+    bench('write', lambda i: d.write('x', f'{deep}/dir_{i}/file.txt'))
+    bench('mv', lambda i: d.mv(f'{deep}/dir_{i}/file.txt', f'{deep}/dir_{i}/moved.txt'))
+    bench('cp', lambda i: d.cp(f'{deep}/dir_{i}/moved.txt', f'{deep}/dir_{i}/copied.txt'))
+    bench('ln', lambda i: d.ln(f'{deep}/dir_{i}/copied.txt', f'{deep}/dir_{i}/linked.txt'))
+    bench('rm', lambda i: d.rm(f'{deep}/dir_{i}'))
+
+    rmtree(d.cwd)
+
+
+if __name__ == '__main__':
+    measure(int(argv[1]) if len(argv) > 1 else 500)
@@ -0,0 +1,83 @@
+"""Memory and checkpoint size per stage for a parameter sweep.
+    Usage: python tests/bench_memory.py [number_of_stages] [depth]
+    Also runs on the original repository (set PYTHONPATH to its src directory) to compare.
+"""
+from sys import argv, getsizeof
+import tracemalloc
+import gc
+import pickle
+
+from stagekit import stage
+from stagekit.stage import Stage
+
+
+@stage
+async def forward(event: int, name: str):
+    pass
+
+
+@stage
+async def sweep():
+    pass
+
+
+def build(n: int, depth: int) -> Stage:
+    root = Stage(sweep, [], {}, None, 0)
+    root.version = 1
+    parent = root
+
+    # completed stages between root stage and the sweep
+    for d in range(depth - 1):
+        s = Stage(sweep, [], {}, f'level_{d}', 1)
+        s.parent = parent
+        s.version = 1
+        s.done = True
+        parent.history = [s]
+        parent = s
+
+    history = []
+
+    for i in range(n):
+        s = Stage(forward, [i, f'event_{i:06d}'], {}, None, 1)
+        s.parent = parent
+        s.version = 1
+        s.done = True
+        s.result = i
+
+        if hasattr(s, 'fingerprint'):
+            s.fingerprint()
+
+        history.append(s)
+
+    parent.history = history
+
+    return root
+
+
+def measure(n: int, depth: int):
+    tracemalloc.start()
+
+    start = tracemalloc.get_traced_memory()[0]
+    root = build(n, depth)
+
+    # measured after a checkpoint, since completed stages keep their serialized child stages
+    blob = pickle.dumps([root])
+    print(f'in memory:  {(tracemalloc.get_traced_memory()[0] - start - getsizeof(blob)) / n:.0f} bytes / stage')
+    print(f'checkpoint: {len(blob) / n:.0f} bytes / stage')
+
+    del root
+    gc.collect()
+    start = tracemalloc.get_traced_memory()[0]
+    loaded = pickle.loads(blob)[0]
+
+    while loaded.history and len(loaded.history) == 1:
+        loaded = loaded.history[0]
+
+    for s in loaded.history:
+        s.result
+
+    print(f'restored:   {(tracemalloc.get_traced_memory()[0] - start) / n:.0f} bytes / stage')
+
+
+if __name__ == '__main__':
+    measure(int(argv[1]) if len(argv) > 1 else 100000, int(argv[2]) if len(argv) > 2 else 1)
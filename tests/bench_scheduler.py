@@ -0,0 +1,90 @@
+"""Latency between a task finishing and the next queued task being dispatched by mpiexec,
+    and time to enqueue a task while all nodes are busy.
+    Usage: python tests/bench_scheduler.py [number_of_tasks] [number_of_nodes]
+"""
+import asyncio
+from sys import argv
+from time import perf_counter
+from math import inf
+from fractions import Fraction
+from importlib import import_module
+from statistics import median
+
+from stagekit.config import config
+from stagekit.jobs.local import Local
+
+# module (stagekit.mpiexec is shadowed by the function of the same name)
+mpiexec = import_module('stagekit.mpiexec')
+
+
+async def task(latencies: list, finished: list):
+    lock = asyncio.Lock()
+
+    # every task occupies the whole node, so tasks are dispatched one by one
+    await mpiexec._wait(lock, Fraction(1), (1, (1, 0, 0), True), 0, inf)
+
+    if finished:
+        latencies.append(perf_counter() - finished[0])
+
+    await asyncio.sleep(0)
+
+    finished[:] = [perf_counter()]
+    mpiexec._finish(lock)
+
+
+async def measure(n: int):
+    mpiexec._job = Local({'nnodes': 1, 'share_node': False})
+    mpiexec._nodes.clear()
+
+    # dispatch latencies and time when the last task finished
+    latencies = []
+    finished = []
+
+    start = perf_counter()
+    await asyncio.gather(*(task(latencies, finished) for _ in range(n)))
+    total = perf_counter() - start
+
+    print(f'scheduler: {config["mpiexec_scheduler"]}')
+    print(f'tasks:   {n}')
+    print(f'total:   {total:.3f}s')
+    print(f'median:  {median(latencies) * 1e6:.1f}us')
+    print(f'max:     {max(latencies) * 1e6:.1f}us')
+
+
+async def enqueue(n: int, nnodes: int):
+    mpiexec._job = Local({'nnodes': nnodes, 'cpus_per_node': 4, 'no_mpi': False})
+    mpiexec._nodes.clear()
+
+    # tasks that occupy all nodes
+    busy = [asyncio.Lock() for _ in range(nnodes)]
+
+    for lock in busy:
+        await mpiexec._wait(lock, Fraction(1), (1, (4, 0, 0), False), 0, inf)
+
+    # queued tasks of different sizes, so that each size is a separate group
+    locks = [asyncio.Lock() for _ in range(n)]
+    start = perf_counter()
+    waiting = [asyncio.create_task(mpiexec._wait(lock, Fraction(i % 10 + 1), (i % 10 + 1, (4, 0, 0), False), 0, inf))
+               for i, lock in enumerate(locks)]
+
+    await asyncio.sleep(0)
+    total = perf_counter() - start
+
+    print(f'nodes:   {nnodes}')
+    print(f'enqueue: {total / n * 1e6:.1f}us / task')
+
+    # remove queued tasks before releasing the nodes
+    for lock in locks + busy:
+        mpiexec._finish(lock)
+
+    for t in waiting:
+        t.cancel()
+
+    await asyncio.gather(*waiting, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    for scheduler in 'priority', 'backfill':
+        config['mpiexec_scheduler'] = scheduler
+        asyncio.run(measure(int(argv[1]) if len(argv) > 1 else 100))
+        asyncio.run(enqueue(int(argv[1]) if len(argv) > 1 else 100, int(argv[2]) if len(argv) > 2 else 100))
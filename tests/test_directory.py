@@ -0,0 +1,50 @@
+from os import getcwd
+from stagekit import stage, ctx
+from stagekit.directory import root
+
+
+@stage(rerun=True)
+async def test():
+    """Check that Directory operations fail instead of removing or skipping files."""
+    ctx.write('keep', 'test_directory/keep.txt')
+
+    # the working directory is never removed, as `rm -rf .` refuses
+    for src in '.', '', '..', getcwd():
+        try:
+            root.rm(src)
+
+        except OSError:
+            pass
+
+        else:
+            raise AssertionError(f'rm({src!r}) did not fail')
+
+    try:
+        ctx.rm()
+
+    except OSError:
+        pass
+
+    else:
+        raise AssertionError('ctx.rm() did not fail')
+
+    assert root.read('test_directory/keep.txt') == 'keep'
+
+    # missing sources are reported as the shell commands did
+    for op in root.cp, root.mv:
+        for src in 'test_directory/missing.txt', 'test_directory/*.missing':
+            try:
+                op(src, 'test_directory/dst.txt')
+
+            except FileNotFoundError:
+                pass
+
+            else:
+                raise AssertionError(f'{op.__name__}({src!r}) did not fail')
+
+    assert not root.has('test_directory/dst.txt')
+
+    root.rm('test_directory')
+    assert not root.has('test_directory')
+    print('checked')
+
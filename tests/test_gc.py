@@ -0,0 +1,60 @@
+import numpy as np
+from stagekit import stage, ctx
+from stagekit.config import config
+from stagekit.data.data import Data
+
+
+# unused data is removed after the workflow is saved
+config['gc_on_exit'] = True
+
+
+@stage(rerun=True)
+async def test():
+    for i in range(2):
+        ctx.setwd(f'mid_{i}')
+        await mid(i)
+
+    ctx.setwd()
+
+
+@stage
+async def mid(i):
+    for j in range(2):
+        await leaf(j, arr=np.arange(100000) * (i + 1))
+
+
+@stage
+async def leaf(j, arr):
+    print(j, arr.sum())
+    return arr[:10]
+
+
+@stage(rerun=True)
+async def check():
+    """Load the keyword arguments of saved leaf stages (run after test)."""
+    from stagekit.cache import load_cache
+
+    queue = list(load_cache())
+    n = 0
+
+    while queue:
+        s = queue.pop()
+        queue.extend(s.history)
+        arr = s.kwargs.get('arr')
+
+        if isinstance(arr, Data):
+            arr = arr.data
+
+        if arr is not None:
+            assert len(arr) == 100000
+
+            # out-of-band buffers are copy-on-write views of the data chunk
+            assert arr.flags.writeable
+            n += 1
+
+    assert n == 4, n
+    print('checked', n)
+
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,35 @@
+from os import _exit
+from sys import argv
+from stagekit import stage, ctx
+from stagekit.config import config
+
+
+# stage updates are appended to stagekit.journal instead of saving stagekit.pickle
+config['journal_size'] = 100
+
+
+@stage(rerun=True)
+async def test():
+    """Run with `-r -k` to stop the process in the third stage, then run again to resume from the journal."""
+    if '-k' in argv:
+        ctx.rm('test_journal')
+
+    for i in range(4):
+        await leaf(i)
+
+    # stages completed before the process was stopped are not executed again
+    lines = ctx.readlines('test_journal/executed.txt')
+    assert lines == ['0', '1', '2', '3', ''], lines
+
+    ctx.rm('test_journal')
+    print('checked')
+
+
+@stage
+async def leaf(i):
+    if i == 2 and '-k' in argv:
+        # records written so far are kept, as if the process were killed
+        await ctx.flush()
+        _exit(1)
+
+    ctx.write(f'{i}\n', 'test_journal/executed.txt', 'a')
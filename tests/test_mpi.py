@@ -62,12 +62,22 @@ async def test_mpi():
     print(o[1].stdout)
     o = await ctx.mpiexec(_sleep2, 2, args=('parallel_2', 2), mpiargs=('a1', 'a2'))
     print(o.stdout)
+    o = await ctx.mpiexec('echo check_1', check_output=_check)
+    print(o.stdout)
+    o = await ctx.mpiexec('echo check_2', check_output=_check2)
+    print(o.stdout)
 
 
 def _sleep(msg, dur):
     print(msg)
     sleep(dur)
 
+def _check(stdout):
+    assert stdout.strip() == 'check_1', stdout
+
+def _check2(stdout, stderr):
+    assert stdout.strip() == 'check_2' and stderr == '', (stdout, stderr)
+
 def _sleep2(msg, dur):
     sleep(random())
     print(msg, stat.rank, stat.size, stat.mpiargs)
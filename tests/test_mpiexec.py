@@ -0,0 +1,40 @@
+from asyncio import create_task, sleep, wait_for, CancelledError
+from uuid import uuid4
+from stagekit import stage, ctx
+from stagekit.config import config
+
+
+# a single process occupies the local node, so that the second task is queued
+config['job']['cpus_per_node'] = 1
+
+
+@stage(rerun=True)
+async def test():
+    """Cancel a queued task, the next task is still dispatched after the running task finishes."""
+    # tasks are executed again instead of returning saved results
+    run = uuid4().hex
+
+    running = create_task(ctx.mpiexec(f'sleep 2 # {run}', multiprocessing=True, fname='test_mpiexec_running'))
+    await sleep(0.5)
+
+    queued = create_task(ctx.mpiexec(f'echo cancelled # {run}', multiprocessing=True, fname='test_mpiexec_cancelled'))
+    await sleep(0.5)
+    queued.cancel()
+
+    try:
+        await queued
+
+    except CancelledError:
+        pass
+
+    else:
+        raise AssertionError('queued task was not cancelled')
+
+    await running
+
+    # the cancelled task would otherwise be dispatched in place of this one and never release the node
+    o = await wait_for(ctx.mpiexec(f'echo next # {run}', multiprocessing=True, fname='test_mpiexec_next'), 10)
+    assert o.stdout.strip() == 'next', o.stdout
+
+    ctx.rm('test_mpiexec_*')
+    print('checked')
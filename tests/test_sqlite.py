@@ -0,0 +1,58 @@
+from os import _exit
+from sys import argv
+from time import sleep
+from stagekit import stage, ctx
+from stagekit.config import config
+from stagekit.writer import writer
+
+
+# each stage update is saved as a row in stagekit.db
+config['state_backend'] = 'sqlite'
+
+
+@stage(rerun=True)
+async def test():
+    """Run with `-r -k` to stop the process in the third stage, then run again to resume from the database."""
+    if '-k' in argv:
+        ctx.rm('test_sqlite')
+
+    # a child stage added in this run is found again before its row is written
+    for _ in range(2):
+        await repeat()
+
+    if '-k' not in argv:
+        lines = ctx.readlines('test_sqlite/repeat.txt')
+        assert lines == ['new', ''], lines
+
+    for i in range(4):
+        await leaf(i)
+
+    # stages completed before the process was stopped are not executed again
+    lines = ctx.readlines('test_sqlite/executed.txt')
+    assert lines == ['0', '1', '2', '3', ''], lines
+
+    ctx.rm('test_sqlite')
+    print('checked')
+
+
+@stage
+async def leaf(i):
+    if i == 2 and '-k' in argv:
+        # rows written so far are kept, as if the process were killed
+        await ctx.flush()
+        _exit(1)
+
+    ctx.write(f'{i}\n', 'test_sqlite/executed.txt', 'a')
+
+
+@stage(rerun=True)
+async def repeat():
+    # delay the writer thread, so that rows written in this run are not in database yet
+    writer.submit(lambda: sleep(0.5))
+    await new('-k' not in argv)
+
+
+@stage
+async def new(resumed):
+    if resumed:
+        ctx.write('new\n', 'test_sqlite/repeat.txt', 'a')